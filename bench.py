@@ -0,0 +1,650 @@
+"""Benchmarks for cbypython.
+
+    python3 bench.py lexer [--functions N] [--repeat R]
+    python3 bench.py input [--functions N]
+    python3 bench.py tokens [--functions N]
+    python3 bench.py parser [--terms N] [--repeat R]
+    python3 bench.py traversal [--functions N] [--repeat R]
+    python3 bench.py ast [--functions N]
+    python3 bench.py chunks [--functions N] [--repeat R] [--jobs J ...]
+    python3 bench.py codegen [--functions N] [--repeat R]
+    python3 bench.py runtime [--scale S] [--repeat R]
+    python3 bench.py server [--programs N]
+
+Every benchmark runs on a synthetic program made of N copies of a small
+function exercising declarations, arrays, loops, branches and calls,
+except runtime, which times the compiled programs of RUNTIME_PROGRAMS,
+and server, which compiles the first N programs of test.sh (all by
+default) through a cold CLI, cbyclient.py and the socket directly.
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cbyclient
+import cbypython
+
+
+FUNCTION_TEMPLATE = '''int f{k}(int a, int b){{
+    int x[3] = {{7,9,11}};
+    int i;
+    i = 1;
+    while(i <= 3){{
+        if(x[i] > a) then a = a + x[i] * 2; else b = b - (a / 3);
+        i = i + 1;
+    }}
+    return a + b;
+}}
+'''
+
+MAIN_TEMPLATE = '''int main(){{
+    return f{k}(1, 2) - f{k}(1, 2);
+}}
+'''
+
+
+def generate_program(functions):
+    parts = [FUNCTION_TEMPLATE.format(k=k) for k in range(functions)]
+    parts.append(MAIN_TEMPLATE.format(k=functions - 1))
+    return ''.join(parts)
+
+
+def best_of(repeat, run):
+    """Run `run()` `repeat` times, return (best seconds, last result)."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def lex_with(lexer_class, text):
+    def run():
+        return lexer_class(text).gather_all_tokens()
+    return run
+
+
+def token_key(token):
+    return (token.type, token.value, token.lineno, token.column, token.width)
+
+
+def bench_lexer(args):
+    text = generate_program(args.functions)
+    print(f"lexer: {args.functions} functions, {text.count(chr(10))} lines, {len(text)} bytes")
+    reference = None
+    for name, lexer_class in sorted(cbypython.LEXERS.items()):
+        seconds, tokens = best_of(args.repeat, lex_with(lexer_class, text))
+        keys = [token_key(t) for t in tokens]
+        if reference is None:
+            reference = keys
+        elif keys != reference:
+            print(f"  {name}: token stream differs from the reference", file=sys.stderr)
+            sys.exit(1)
+        print(f"  {name:6s} {seconds * 1000:9.1f} ms  "
+              f"{len(tokens) / seconds:12,.0f} tokens/s  "
+              f"{len(text) / seconds / 1e6:7.2f} MB/s")
+
+
+def read_lines_and_concatenate(path):
+    """How main() used to read its input."""
+    buffer = open(path, 'r').readlines()
+    text = ''
+    for line in buffer:
+        text += line
+    return buffer, text
+
+
+def measure_peak(run):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def bench_input(args):
+    text = generate_program(args.functions)
+    with tempfile.NamedTemporaryFile('w', suffix='.c', delete=False) as f:
+        f.write(text)
+    try:
+        print(f"input: {len(text)} bytes")
+        for name, run in (('readlines', lambda: read_lines_and_concatenate(f.name)),
+                          ('mmap', lambda: cbypython.Inputfile.load(f.name))):
+            seconds, peak, _ = measure_peak(run)
+            print(f"  {name:9s} {seconds * 1000:9.1f} ms  peak heap {peak / 1e6:8.2f} MB")
+    finally:
+        os.unlink(f.name)
+
+
+class DictToken:
+    """Token as it was before it got __slots__."""
+    def __init__(self, type, value, lineno=None, column=None, width=None):
+        self.type = type
+        self.value = value
+        self.lineno = lineno
+        self.column = column
+        self.width = width
+
+
+def lex_token_list(text, token_class):
+    saved = cbypython.Token
+    cbypython.Token = token_class
+    try:
+        return cbypython.TableLexer(text).gather_all_tokens()
+    finally:
+        cbypython.Token = saved
+
+
+def bench_tokens(args):
+    text = generate_program(args.functions).encode()
+    print(f"tokens: {len(text)} bytes of source")
+    for name, run in (('dict Token list', lambda: lex_token_list(text, DictToken)),
+                      ('slots Token list', lambda: lex_token_list(text, cbypython.Token)),
+                      ('TokenBuffer', lambda: cbypython.TokenBuffer(text))):
+        seconds, peak, tokens = measure_peak(run)
+        print(f"  {name:16s} {len(tokens):8d} tokens  {peak / len(tokens):7.1f} bytes/token  "
+              f"({seconds * 1000:.0f} ms traced)")
+
+
+class TokenList:
+    """Feeds already lexed tokens to a Parser, so only parsing is timed."""
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def get_next_token(self):
+        token = self.tokens[self.pos]
+        if self.pos < len(self.tokens) - 1:
+            self.pos += 1
+        return token
+
+
+def parse_tokens(parser_class, tokens):
+    return parser_class(TokenList(tokens)).parse()
+
+
+def generate_expression(terms):
+    operators = ['+', '-', '*', '/', '<', '==', '&&', '||', '>=', '!=']
+    parts = ['a']
+    for k in range(1, terms):
+        parts.append(operators[k % len(operators)])
+        parts.append(str(k) if k % 3 else 'b')
+    return ' '.join(parts)
+
+
+def nested_expression(depth):
+    return '(' * depth + '1' + ')' * depth
+
+
+def handles_depth(parser_class, depth):
+    text = 'int main(){ return ' + nested_expression(depth) + '; }'
+    tokens = cbypython.TableLexer(text).gather_all_tokens()
+    try:
+        parse_tokens(parser_class, tokens)
+    except RecursionError:
+        return False
+    return True
+
+
+def max_depth(parser_class, limit):
+    """Deepest parenthesis nesting the parser accepts, up to `limit`."""
+    if handles_depth(parser_class, limit):
+        return limit
+    low, high = 0, limit
+    while high - low > 1:
+        middle = (low + high) // 2
+        if handles_depth(parser_class, middle):
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def bench_parser(args):
+    text = ('int main(){ int a, b; a = 1; b = 2; return ' +
+            generate_expression(args.terms) + '; }')
+    tokens = cbypython.TableLexer(text).gather_all_tokens()
+    print(f"parser: expression of {args.terms} operands, {len(tokens)} tokens, "
+          f"recursion limit {sys.getrecursionlimit()}")
+    for name, parser_class in sorted(cbypython.PARSERS.items()):
+        seconds, _ = best_of(args.repeat, lambda: parse_tokens(parser_class, tokens))
+        depth = max_depth(parser_class, args.max_depth)
+        deepest = f"{depth}" if depth < args.max_depth else f">= {depth}"
+        print(f"  {name:9s} {seconds * 1000:9.1f} ms  {args.terms / seconds:12,.0f} operands/s  "
+              f"max nesting {deepest}")
+
+
+def recursive_visit(visitor, node):
+    """Run the same visit_X_Node methods through the Python call stack."""
+    method = visitor._visit_methods().get(node.__class__)
+    if method is None:
+        method = getattr(type(visitor), f'visit_{node.__class__.__name__}')
+    walker = method(visitor, node)
+    if walker is not None:
+        for child in walker:
+            recursive_visit(visitor, child)
+
+
+class RecursiveSemanticAnalyzer(cbypython.SemanticAnalyzer):
+    visit = recursive_visit
+
+
+class RecursiveCodegenerator(cbypython.Codegenerator):
+    visit = recursive_visit
+
+
+TRAVERSALS = {
+    'stack': (cbypython.SemanticAnalyzer, cbypython.Codegenerator),
+    'recursive': (RecursiveSemanticAnalyzer, RecursiveCodegenerator),
+}
+
+
+def node_fields(node):
+    for cls in type(node).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            yield getattr(node, name, None)
+
+
+def count_nodes(tree):
+    count = 0
+    stack = list(tree)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, cbypython.AST_Node):
+            count += 1
+            stack.extend(node_fields(node))
+    return count
+
+
+def analyze_and_generate(passes, text):
+    analyzer_class, generator_class = passes
+    tree = cbypython.Parser(cbypython.TableLexer(text)).parse()
+
+    def run():
+        analyzer_class().semantic_analyze(tree)
+        with contextlib.redirect_stdout(io.StringIO()):
+            generator_class().code_generate(tree)
+    return tree, run
+
+
+def handles_chain(passes, length):
+    text = 'int main(){ return ' + ' - '.join(['1'] * length) + '; }'
+    try:
+        analyze_and_generate(passes, text)[1]()
+    except RecursionError:
+        return False
+    return True
+
+
+def bench_traversal(args):
+    text = generate_program(args.functions)
+    for name, passes in sorted(TRAVERSALS.items()):
+        tree, run = analyze_and_generate(passes, text)
+        nodes = count_nodes(tree)
+        seconds, _ = best_of(args.repeat, run)
+        low, high = 1, args.max_depth
+        if handles_chain(passes, high):
+            deepest = f">= {high}"
+        else:
+            while high - low > 1:
+                middle = (low + high) // 2
+                if handles_chain(passes, middle):
+                    low = middle
+                else:
+                    high = middle
+            deepest = f"{low}"
+        print(f"  {name:9s} {nodes} nodes  {seconds * 1e9 / nodes:7.0f} ns/node (analyze+codegen)  "
+              f"longest '1 - 1 - ...' chain {deepest}")
+
+
+def parse_and_analyze(text):
+    tree = cbypython.Parser(cbypython.TableLexer(text)).parse()
+    cbypython.SemanticAnalyzer().semantic_analyze(tree)
+    return tree
+
+
+def ast_worker(functions, results):
+    text = generate_program(functions)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    tree = parse_and_analyze(text)
+    seconds = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((count_nodes(tree), seconds, rss_before, rss_after))
+
+
+def bench_ast(args):
+    # a fresh process per measurement, so that the peak RSS is our own
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    worker = context.Process(target=ast_worker, args=(args.functions, results))
+    worker.start()
+    nodes, seconds, rss_before, rss_after = results.get()
+    worker.join()
+    print(f"ast: {args.functions} functions, {nodes} nodes")
+    print(f"  parse+analyze {seconds * 1000:9.1f} ms  {nodes / seconds:12,.0f} nodes/s")
+    print(f"  peak RSS {rss_after / 1024:8.1f} MB  "
+          f"(+{(rss_after - rss_before) / 1024:.1f} MB over the loaded source)")
+
+    small = generate_program(max(1, args.functions // 20))
+    _, peak, tree = measure_peak(lambda: parse_and_analyze(small))
+    print(f"  {peak / count_nodes(tree):7.1f} traced bytes per node (tokens and symbols included)")
+
+
+def bench_chunks(args):
+    text = generate_program(args.functions)
+    lines = text.count('\n')
+    def run(jobs):
+        context = cbypython.CompileContext(cbypython.Inputfile('<bench>', text), chunk_jobs=jobs)
+        cbypython.compile_to(context, cbypython.Emitter())
+    serial, _ = best_of(args.repeat, lambda: run(1))
+    print(f"  serial   {lines} lines  {serial * 1000:9.1f} ms  {lines / serial:12,.0f} lines/s")
+    for jobs in args.jobs:
+        seconds, _ = best_of(args.repeat, lambda: run(jobs))
+        print(f"  jobs={jobs:<3d} {lines} lines  {seconds * 1000:9.1f} ms  "
+              f"{lines / seconds:12,.0f} lines/s  x{serial / seconds:.2f}")
+
+
+class PrintEmitter:
+    """Emits the way the code generator used to: one print() per line."""
+    def __init__(self, file):
+        self.file = file
+
+    def emit(self, line):
+        print(line, file=self.file)
+
+    def flush(self):
+        pass
+
+
+def bench_codegen(args):
+    text = generate_program(args.functions)
+    tree = parse_and_analyze(text)
+    with tempfile.TemporaryFile('w+') as output:
+        for name, emitter_class in (('print', PrintEmitter), ('buffered', cbypython.Emitter)):
+            def run():
+                output.seek(0)
+                output.truncate()
+                cbypython.Codegenerator(emitter_class(output)).code_generate(tree)
+                output.flush()
+                return output.tell()
+            seconds, _ = best_of(args.repeat, run)
+            output.seek(0)
+            lines = sum(1 for _ in output)
+            print(f"  {name:8s} {lines} lines  {seconds * 1000:9.1f} ms  "
+                  f"{lines / seconds:12,.0f} lines/s")
+        # per-function parallel generation, on a fresh context each time
+        for jobs in args.jobs:
+            def run():
+                output.seek(0)
+                output.truncate()
+                context = cbypython.CompileContext(codegen_jobs=jobs)
+                cbypython.Codegenerator(cbypython.Emitter(output), context).code_generate(tree)
+            seconds, _ = best_of(args.repeat, run)
+            print(f"  jobs={jobs:<3d} {lines} lines  {seconds * 1000:9.1f} ms  "
+                  f"{lines / seconds:12,.0f} lines/s")
+
+
+# programs whose running time the code generators are compared on;
+# {n} is scaled by --scale
+RUNTIME_PROGRAMS = {
+    'loops': '''int main() {
+    int i, j, s;
+    s = 0;
+    i = 0;
+    while (i < {n}) {
+        j = 0;
+        while (j < 1000) {
+            s = s + i * j - (s && 255);
+            j = j + 1;
+        }
+        i = i + 1;
+    }
+    return s;
+}
+''',
+    'sort': '''int main() {
+    int round, i, j, t, s;
+    s = 0;
+    round = 0;
+    while (round < {n}) {
+        int a[8] = {8, 3, 7, 1, 6, 2, 5, 4};
+        i = 1;
+        while (i < 8) {
+            j = 1;
+            while (j <= 8 - i) {
+                if (a[j] > a[j + 1]) then {
+                    t = a[j];
+                    a[j] = a[j + 1];
+                    a[j + 1] = t;
+                }
+                j = j + 1;
+            }
+            i = i + 1;
+        }
+        s = s + a[1] * round + a[8];
+        round = round + 1;
+    }
+    return s;
+}
+''',
+    'leaf calls': '''int clamp(int x, int hi) {
+    if (x > hi) then return hi;
+    return x;
+}
+int mix(int a, int b) {
+    return a * 31 + b;
+}
+int main() {
+    int i, j, s;
+    s = 0;
+    i = 0;
+    while (i < {n}) {
+        j = 0;
+        while (j < 100) {
+            s = clamp(mix(s, j), 1000000);
+            j = j + 1;
+        }
+        i = i + 1;
+    }
+    return s && 255;
+}
+''',
+    'array init': '''int table(int k) {
+    int t[1000] = {''' + ', '.join(str(i * 7 % 100) for i in range(1000)) + '''};
+    return t[k];
+}
+int main() {
+    int i, s;
+    s = 0;
+    i = 0;
+    while (i < {n}) {
+        s = s + table((i && 511) + 1);
+        i = i + 1;
+    }
+    return s && 255;
+}
+''',
+    'division': '''int main() {
+    int i, j, n, s;
+    s = 0;
+    i = 0;
+    while (i < {n}) {
+        j = 0;
+        while (j < 250) {
+            n = i * 1000 + j;
+            s = s + n / 7 - n / 10 * 3 + n / 16 + (s && 1023) / -3;
+            j = j + 1;
+        }
+        i = i + 1;
+    }
+    return s && 255;
+}
+''',
+    'calls': '''int fib(int n) {
+    if (n < 2) then return n;
+    return fib(n - 1) + fib(n - 2);
+}
+int main() {
+    return fib({n} / 1000 + 14);
+}
+''',
+}
+
+
+def build(source, directory, name, options):
+    """Compile and link `source`; return the executable and the assembly size."""
+    assembly = os.path.join(directory, f'{name}.s')
+    executable = os.path.join(directory, name)
+    text = cbypython.compile_source(source, name, **options).assembly
+    with open(assembly, 'w') as f:
+        f.write(text)
+    subprocess.run(['gcc', '-o', executable, assembly], check=True, stderr=subprocess.DEVNULL)
+    return executable, len(text)
+
+
+def bench_runtime(args):
+    variants = (
+        ('stack', dict(backend='stack')),
+        ('stack -O1', dict(backend='stack', optimize=1)),
+        ('regalloc', dict(backend='regalloc')),
+        ('regalloc -O1', dict(backend='regalloc', optimize=1)),
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for program, template in RUNTIME_PROGRAMS.items():
+            source = template.replace('{n}', str(args.scale))
+            print(f"  {program}")
+            baseline = None
+            for name, options in variants:
+                executable, size = build(source, directory, program, options)
+                seconds, status = best_of(args.repeat, lambda: subprocess.run([executable]).returncode)
+                if baseline is None:
+                    baseline, expected = seconds, status
+                elif status != expected:
+                    sys.exit(f"{program}: {name} exits with {status}, stack with {expected}")
+                print(f"    {name:13s} {seconds * 1000:9.1f} ms  {baseline / seconds:5.2f}x"
+                      f"  {size / 1024:8.1f} KB assembly")
+
+
+def test_corpus():
+    """The programs test.sh compiles, in order."""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test.sh')) as f:
+        return re.findall(r"assert (\d+) '(.*?)'", f.read(), re.DOTALL)
+
+
+def time_each(corpus, run):
+    start = time.perf_counter()
+    for _, source in corpus:
+        run(source)
+    return time.perf_counter() - start
+
+
+def bench_server(args):
+    corpus = test_corpus()[:args.programs]
+    here = os.path.dirname(os.path.abspath(__file__))
+    compiler = os.path.join(here, 'cbypython.py')
+    client = os.path.join(here, 'cbyclient.py')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'cbypython.sock')
+        server = subprocess.Popen([sys.executable, compiler, '--server', path],
+                                  stderr=subprocess.DEVNULL)
+        try:
+            while not os.path.exists(path):
+                time.sleep(0.01)
+            runs = (
+                ('cold cli', lambda source: subprocess.run(
+                    [sys.executable, compiler, '-'], input=source.encode(),
+                    stdout=subprocess.DEVNULL, check=True)),
+                ('client', lambda source: subprocess.run(
+                    [sys.executable, client, '--socket', path, '-'], input=source.encode(),
+                    stdout=subprocess.DEVNULL, check=True)),
+                ('socket', lambda source: cbyclient.request(path, '-', source)),
+            )
+            for name, run in runs:
+                seconds = time_each(corpus, run)
+                print(f"  {name:8s} {len(corpus)} programs  {seconds:7.2f} s  "
+                      f"{seconds / len(corpus) * 1000:8.2f} ms/program")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='cbypython benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    lexer_parser = subparsers.add_parser('lexer', help='lexer throughput')
+    lexer_parser.add_argument('--functions', type=int, default=2000)
+    lexer_parser.add_argument('--repeat', type=int, default=3)
+    lexer_parser.set_defaults(run=bench_lexer)
+
+    input_parser = subparsers.add_parser('input', help='source loading time and memory')
+    input_parser.add_argument('--functions', type=int, default=20000)
+    input_parser.set_defaults(run=bench_input)
+
+    tokens_parser = subparsers.add_parser('tokens', help='token storage bytes per token')
+    tokens_parser.add_argument('--functions', type=int, default=500)
+    tokens_parser.set_defaults(run=bench_tokens)
+
+    parser_parser = subparsers.add_parser('parser', help='expression parsing speed and depth')
+    parser_parser.add_argument('--terms', type=int, default=50000)
+    parser_parser.add_argument('--repeat', type=int, default=3)
+    parser_parser.add_argument('--max-depth', type=int, default=100000)
+    parser_parser.set_defaults(run=bench_parser)
+
+    traversal_parser = subparsers.add_parser('traversal', help='AST pass overhead and depth')
+    traversal_parser.add_argument('--functions', type=int, default=1000)
+    traversal_parser.add_argument('--repeat', type=int, default=3)
+    traversal_parser.add_argument('--max-depth', type=int, default=100000)
+    traversal_parser.set_defaults(run=bench_traversal)
+
+    ast_parser = subparsers.add_parser('ast', help='AST memory and parse+analyze speed')
+    ast_parser.add_argument('--functions', type=int, default=10000)
+    ast_parser.set_defaults(run=bench_ast)
+
+    chunks_parser = subparsers.add_parser('chunks', help='whole-file compile scaling over processes')
+    chunks_parser.add_argument('--functions', type=int, default=20000)
+    chunks_parser.add_argument('--repeat', type=int, default=3)
+    chunks_parser.add_argument('--jobs', type=int, nargs='*', default=[2, 4, 8])
+    chunks_parser.set_defaults(run=bench_chunks)
+
+    codegen_parser = subparsers.add_parser('codegen', help='assembly emission throughput')
+    codegen_parser.add_argument('--functions', type=int, default=2000)
+    codegen_parser.add_argument('--repeat', type=int, default=3)
+    codegen_parser.add_argument('--jobs', type=int, nargs='*', default=[2, 4],
+                                help='also time --codegen-jobs with these worker counts')
+    codegen_parser.set_defaults(run=bench_codegen)
+
+    runtime_parser = subparsers.add_parser('runtime', help='running time of the generated code, '
+                                                        'per backend')
+    runtime_parser.add_argument('--scale', type=int, default=20000)
+    runtime_parser.add_argument('--repeat', type=int, default=3)
+    runtime_parser.set_defaults(run=bench_runtime)
+
+    server_parser = subparsers.add_parser('server', help='per-program latency, cold CLI vs. --server')
+    server_parser.add_argument('--programs', type=int, default=None)
+    server_parser.set_defaults(run=bench_server)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Thin client for a warm compiler started with `cbypython.py --server`.
+
+    python3 cbyclient.py [-o OUTPUT] [--socket SOCKET] [-O{0,1}]
+                         [--backend {regalloc,stack}] [--short-circuit]
+                         [--emit-ir] [--verify-ir] [--lexer LEXER]
+                         [--parser PARSER] [--token-buffer] inputfile
+
+Sends the source ("-" for stdin) to the server and writes back the
+assembly, or prints the diagnostics and exits with status 1, just like
+`cbypython.py inputfile` would with the same options.  It imports only
+what it needs, so it starts much faster than the compiler itself.
+
+Every message, both ways, is a 4-byte big-endian length followed by that
+much JSON: the request is {"name", "source", "options"}, the reply
+{"status", "assembly", "diagnostics"}.
+"""
+import json
+import os
+import socket
+import struct
+import sys
+
+
+def receive_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('server closed the connection')
+        data += chunk
+    return bytes(data)
+
+
+def request(path, name, source, options=None):
+    """Send one compile request to the server at `path`, return its reply."""
+    data = json.dumps({'name': name, 'source': source, 'options': options or {}}).encode()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(struct.pack('>I', len(data)) + data)
+        (length,) = struct.unpack('>I', receive_exactly(sock, 4))
+        return json.loads(receive_exactly(sock, length))
+
+
+# the options of cbypython.py forwarded to the server, by their names
+# in CompileContext: those taking a value, and the flags
+VALUE_OPTIONS = {'-O': 'optimize', '--backend': 'backend', '--lexer': 'lexer',
+                 '--parser': 'parser'}
+FLAG_OPTIONS = {'--short-circuit': 'short_circuit', '--emit-ir': 'emit_ir',
+                '--verify-ir': 'verify_ir', '--token-buffer': 'token_buffer'}
+
+
+def parse_arguments(argv):
+    """Return (socket path, output, inputfile, options), None if `argv` is wrong."""
+    path = os.environ.get('CBYPYTHON_SOCKET') or f'/tmp/cbypython-{os.getuid()}.sock'
+    output = None
+    inputfile = None
+    options = {}
+    args = iter(argv)
+    for arg in args:
+        # -O1 and --backend=regalloc as well as -O 1 and --backend regalloc
+        name, _, value = arg.partition('=') if arg[:2] == '--' else (arg[:2], '', arg[2:])
+        if arg == '-o' or arg == '--socket':
+            value = next(args, None)
+            if value is None:
+                return None
+            if arg == '-o':
+                output = value
+            else:
+                path = value
+        elif name in VALUE_OPTIONS:
+            value = value or next(args, None)
+            if name == '-O':
+                if value not in ('0', '1'):
+                    return None
+                value = int(value)
+            elif value is None:
+                return None
+            options[VALUE_OPTIONS[name]] = value
+        elif arg in FLAG_OPTIONS:
+            options[FLAG_OPTIONS[arg]] = True
+        elif arg[:1] == '-' and arg != '-' or inputfile is not None:
+            return None
+        else:
+            inputfile = arg
+    if inputfile is None:
+        return None
+    if options.get('emit_ir'):
+        # as cbypython.py: the IR is the regalloc backend's
+        options['backend'] = 'regalloc'
+    return path, output, inputfile, options
+
+
+def main(argv):
+    arguments = parse_arguments(argv)
+    if arguments is None:
+        print(__doc__.split('\n\n')[1], file=sys.stderr)
+        return 2
+    path, output, inputfile, options = arguments
+
+    if inputfile == '-':
+        source = sys.stdin.buffer.read()
+    else:
+        with open(inputfile, 'rb') as f:
+            source = f.read()
+    reply = request(path, inputfile, source.decode(errors='replace'), options)
+
+    sys.stderr.write(reply['diagnostics'])
+    if reply['status'] == 0:
+        if output is None or output == '-':
+            sys.stdout.write(reply['assembly'])
+        else:
+            with open(output, 'w') as f:
+                f.write(reply['assembly'])
+    return reply['status']
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,42 +1,139 @@
 import argparse
+import concurrent.futures
+import contextlib
+import fcntl
+import hashlib
+import io
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import signal
+import socketserver
+import stat
 import string
+import struct
 import sys
+import tempfile
+import time
+from array import array
 from enum import Enum
 from abc import ABCMeta, abstractmethod
 
-_SHOULD_LOG_SCOPE = False  # see '--scope' command line option
 parameter_registers=['rdi', 'rsi', 'rdx', 'rcx', 'r8', 'r9']
 
-# global variable "Offset.sum" used for code-generatioin
-class Offset:
-    sum = -999
-
-# global variable "Count.i" used for "if" statement
-class Count():
-    i = 0
-
-# The input source file can be opened in any time,
-# to show error
+# The input source file, kept for the whole compilation
+# to show errors
 class Inputfile():
-    buffer = []
-    name = ''
+    def __init__(self, name, text):
+        self.name = name
+        # whole source: a read-only mmap of a regular file, the bytes of stdin,
+        # or a str handed over directly
+        self.text = text
+        # offset of the first character of each line, built on first use
+        self.line_starts = None
+
+    @classmethod
+    def load(cls, name):
+        """Map (or, for stdin and special files, read in one go) the source."""
+        if name == '-':
+            return cls(name, sys.stdin.buffer.read())
+        with open(name, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+                # the mapping stays valid after the file object is closed
+                return cls(name, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            return cls(name, f.read())
+
+    def line(self, lineno):
+        """Return source line `lineno` (1-based) without its line break."""
+        text = self.text
+        newline = '\n' if isinstance(text, str) else b'\n'
+        if self.line_starts is None:
+            line_starts = [0]
+            pos = text.find(newline)
+            while pos != -1:
+                line_starts.append(pos + 1)
+                pos = text.find(newline, pos + 1)
+            self.line_starts = line_starts
+        start = self.line_starts[lineno - 1]
+        end = text.find(newline, start)
+        line = text[start:] if end == -1 else text[start:end]
+        if not isinstance(line, str):
+            line = line.decode(errors='replace')
+        return line
+
+class CompileContext:
+    """State of one compilation.
+
+    Everything a compilation changes while it runs lives here rather than
+    in module or class attributes, so that any number of compilations can
+    run in one process, one after another or in threads.
+    """
+    def __init__(self, source=None, lexer='table', parser='climbing',
+                 token_buffer=False, log_scope=False, chunk_jobs=1, codegen_jobs=1,
+                 optimize=0, opt_report=False, backend='stack', short_circuit=False,
+                 emit_ir=False, verify_ir=False):
+        # the Inputfile being compiled
+        self.source = source
+        # engine choices, see the command line options of the same names
+        self.lexer = lexer
+        self.parser = parser
+        self.token_buffer = token_buffer
+        self.log_scope = log_scope
+        self.chunk_jobs = chunk_jobs
+        self.codegen_jobs = codegen_jobs
+        # optimization level (-O) and whether to report what it removed
+        self.optimize = optimize
+        self.opt_report = opt_report
+        # code generator, a key of BACKENDS
+        self.backend = backend
+        # && and || evaluate their right operand only if needed, as in C
+        self.short_circuit = short_circuit
+        # the regalloc backend prints its three-address code instead of
+        # assembly, and checks it with verify_ir() after every IR pass
+        self.emit_ir = emit_ir
+        self.verify_ir = verify_ir
+        # frame size of the function being analyzed, used for code-generation
+        self.offset = 0
+        # number of "if"/"while" labels of the function being analyzed
+        self.labels = 0
+        # number of "if"/"while" labels of the functions generated so far; an
+        # "if" or "while" is numbered label_count + its label within the function
+        self.label_count = 0
 
 class ErrorCode(Enum):
     UNEXPECTED_TOKEN = 'Unexpected token'
 
 
 class Error(Exception):
-    lineno = 1
-    column = 1
+    """A compile error at (lineno, column) of the source, when known."""
+    def __init__(self, message='some error', lineno=None, column=None,
+                 error_code=None, token=None):
+        super().__init__(message)
+        self.message = message
+        self.error_code = error_code
+        self.token = token
+        if lineno is None and token is not None:
+            lineno, column = token.lineno, token.column
+        self.lineno = lineno
+        self.column = column
 
-    @classmethod
-    def show_error_at(self, lineno, pos, error_list='some error'):
-        line = Inputfile.buffer[lineno - 1]
-        print(f"{Inputfile.name}:line {lineno}  --->", file=sys.stderr)
-        print(f"{line.rstrip()}", file=sys.stderr)
-        print("%{pos}s".format(pos=pos) % "^", end=' ', file=sys.stderr)
-        print(f"{error_list}", file=sys.stderr)
-        sys.exit(1)
+    def __reduce__(self):
+        # keep the position when sent back from a worker process
+        return type(self), (self.message, self.lineno, self.column, self.error_code, self.token)
+
+    def show_error_at(self, inputfile, file=sys.stderr):
+        """Print the error under the offending source line."""
+        if self.lineno is None:
+            print(f"{inputfile.name}: {self.message}", file=file)
+            return
+        line = inputfile.line(self.lineno)
+        print(f"{inputfile.name}:line {self.lineno}  --->", file=file)
+        print(f"{line.rstrip()}", file=file)
+        print("%{pos}s".format(pos=self.column) % "^", end=' ', file=file)
+        print(f"{self.message}", file=file)
 
 
 class LexerError(Error):
@@ -105,6 +202,8 @@ class TokenType(Enum):
         return [item.value for item in TokenType]
 
 class Token:
+    __slots__ = ('type', 'value', 'lineno', 'column', 'width')
+
     def __init__(self, type, value, lineno=None, column=None, width=None):
         self.type = type
         self.value = value
@@ -112,29 +211,43 @@ class Token:
         self.column = column
         self.width = width
 
+    def __repr__(self):
+        return f"Token({self.type.name}, {self.value!r}, line {self.lineno}, column {self.column})"
+
 
 class Lexer:
-    def __init__(self, text):
+    def __init__(self, text, start=0, stop=None, lineno=1):
+        # only text[start:stop], whose first character is on line `lineno`,
+        # is lexed; it is kept from the start of that line, so that columns
+        # come out the same as when lexing the whole text
+        line_start = text.rfind('\n' if isinstance(text, str) else b'\n', 0, start) + 1
+        text = text[line_start:stop]
+        # this lexer walks characters, so decode a bytes or mmap source first
+        if not isinstance(text, str):
+            text = bytes(text).decode()
         # client string input, e.g. "4 + 2 * 3 - 6 / 2"
         self.text = text
         # self.pos is an index into self.text
-        self.pos = 0
+        self.pos = start - line_start
         self.current_char = self.text[self.pos]
+        # line and column of current_char
+        self.lineno = lineno
+        self.column = self.pos + 1
         # # list of tokens
         self.tokens = []
 
     def advance(self):
         """Advance the `pos` pointer and set the `current_char` variable."""
         if self.current_char == '\n':
-            Error.lineno += 1
-            Error.column = 0
+            self.lineno += 1
+            self.column = 0
 
         self.pos += 1
         if self.pos > len(self.text) - 1:
             self.current_char = None  # Indicates end of input
         else:
             self.current_char = self.text[self.pos]
-            Error.column += 1
+            self.column += 1
 
 
     def skip_whitespace(self):
@@ -153,7 +266,7 @@ class Lexer:
 
         # Create a new token
         token = Token(type=None, value=None)
-        old_column = Error.column
+        old_column = self.column
 
         result = ''
         while self.current_char is not None and self.current_char.isdigit():
@@ -162,9 +275,9 @@ class Lexer:
 
         token.type = TokenType.TK_INTEGER_CONST
         token.value = int(result)
-        token.lineno = Error.lineno
-        token.column = Error.column
-        token.width = Error.column - old_column
+        token.lineno = self.lineno
+        token.column = self.column
+        token.width = self.column - old_column
         return token
 
 
@@ -199,7 +312,7 @@ class Lexer:
             if (self._is_ident1(self.current_char)):
                 # Create a new token
                 token = Token(type=None, value=None)
-                old_column = Error.column
+                old_column = self.column
                 result = self.current_char
                 self.advance()
                 while (self._is_ident2(self.current_char)):
@@ -210,17 +323,17 @@ class Lexer:
                     # get enum member by value, e.g.
                     token.type = TokenType(result)
                     token.value = token.type.value  # e.g. 'return', etc
-                    token.lineno = Error.lineno
-                    token.column = Error.column
-                    token.width = Error.column - old_column
+                    token.lineno = self.lineno
+                    token.column = self.column
+                    token.width = self.column - old_column
                     return token
                 # if not keyword, but identifier
                 else:
                     token.type = TokenType.TK_IDENT
                     token.value = result
-                    token.lineno = Error.lineno
-                    token.column = Error.column
-                    token.width = Error.column - old_column
+                    token.lineno = self.lineno
+                    token.column = self.column
+                    token.width = self.column - old_column
                     return token
 
             # Punctuators
@@ -230,9 +343,9 @@ class Lexer:
                 token = Token(type=None, value=None)
                 # create a token with two-characters lexeme as its value
                 token.type = TokenType(self.text[self.pos:self.pos+2])
-                token.value=token.type.value,  # e.g. '!=', '==', etc
-                token.lineno = Error.lineno
-                token.column = Error.column
+                token.value=token.type.value  # e.g. '!=', '==', etc
+                token.lineno = self.lineno
+                token.column = self.column
                 token.width = 2
                 self.advance()
                 self.advance()
@@ -243,15 +356,15 @@ class Lexer:
                 token = Token(type=None, value=None)
                 # create a token with a single-character lexeme as its value
                 token.type = TokenType(self.current_char)
-                token.value=token.type.value,  # e.g. '+', '-', etc
-                token.lineno = Error.lineno
-                token.column = Error.column
+                token.value=token.type.value  # e.g. '+', '-', etc
+                token.lineno = self.lineno
+                token.column = self.column
                 token.width = 1
                 self.advance()
                 return token
             # no enum member with value equal to self.current_char
             else:
-                Error.show_error_at(Error.lineno, Error.column, "invalid token")
+                raise LexerError("invalid token", self.lineno, self.column)
 
         # EOF (end-of-file) token indicates that there is no more
         # input left for lexical analysis
@@ -266,135 +379,339 @@ class Lexer:
             self.tokens.append(token)
         return self.tokens
 
+
+class TableLexer:
+    """Single-pass lexer driven by one compiled master regex.
+
+    Produces exactly the same Token stream as Lexer (types, values,
+    lineno, column and width), but matches a whole lexeme per step and
+    resolves keywords and punctuators through precomputed dicts instead
+    of walking the input one character at a time.
+
+    `text` may be a str, or bytes/mmap that is scanned in place without
+    decoding the whole buffer first.  Only text[start:stop], whose first
+    character is on line `lineno`, is scanned.
+    """
+    # every member value spelled like an identifier, e.g. 'int', 'while';
+    # Lexer checks identifiers against TokenType.members(), so do we
+    _keywords = {item.value: item for item in TokenType if item.value.isidentifier()}
+    _punctuators = {item.value: item for item in TokenType
+                    if len(item.value) <= 2 and all(c in string.punctuation for c in item.value)}
+    # the two-character punctuators come first, so that '==' wins over '='
+    _pattern = (r'(\s+)|(\d+)|([A-Za-z_][A-Za-z0-9_]*)|(' +
+                '|'.join(re.escape(p) for p in sorted(_punctuators, key=len, reverse=True)) +
+                r')')
+    _master = re.compile(_pattern)
+    # the same tables for sources given as bytes or mmap
+    _keywords_bytes = {value.encode(): item for value, item in _keywords.items()}
+    _punctuators_bytes = {value.encode(): item for value, item in _punctuators.items()}
+    _master_bytes = re.compile(_pattern.encode())
+
+    def __init__(self, text, start=0, stop=None, lineno=1):
+        self.text = text
+        self.start = start
+        self.stop = len(text) if stop is None else stop
+        self.lineno = lineno
+        self.tokens = []
+        self._stream = self._tokenize()
+
+    def scan(self):
+        """Yield (type, lexeme, start, end, lineno, column, width) for every token.
+
+        `lexeme` is the matched text for identifiers and numbers and None
+        for keywords and punctuators, whose value is `type.value`.  The
+        final EOF token is not included.
+        """
+        text = self.text
+        end_of_text = self.stop
+        if isinstance(text, str):
+            keywords = self._keywords
+            punctuators = self._punctuators
+            match = self._master.match
+            newline = '\n'
+        else:
+            keywords = self._keywords_bytes
+            punctuators = self._punctuators_bytes
+            match = self._master_bytes.match
+            newline = b'\n'
+        lineno = self.lineno
+        pos = self.start
+        line_start = text.rfind(newline, 0, pos) + 1
+        while pos < end_of_text:
+            m = match(text, pos, end_of_text)
+            if m is None:
+                raise LexerError("invalid token", lineno, pos - line_start + 1)
+            kind = m.lastindex
+            end = m.end()
+            if kind == 1:  # whitespace
+                blank = m.group(1)
+                newlines = blank.count(newline)
+                if newlines:
+                    lineno += newlines
+                    line_start = pos + blank.rfind(newline) + 1
+                pos = end
+                continue
+            lexeme = m.group(kind)
+            if kind == 4:  # punctuator, column is where it starts
+                yield (punctuators[lexeme], None, pos, end, lineno, pos - line_start + 1, end - pos)
+                pos = end
+                continue
+            # Lexer reports numbers and identifiers at the column of the character
+            # following the lexeme (or of the last character when at end of input)
+            column = end - line_start + (end < end_of_text)
+            width = column - (pos - line_start + 1)
+            if kind == 2:
+                yield (TokenType.TK_INTEGER_CONST, lexeme, pos, end, lineno, column, width)
+            else:
+                type = keywords.get(lexeme)
+                if type is None:
+                    yield (TokenType.TK_IDENT, lexeme, pos, end, lineno, column, width)
+                else:
+                    yield (type, None, pos, end, lineno, column, width)
+            pos = end
+
+    def _tokenize(self):
+        to_str = str if isinstance(self.text, str) else bytes.decode
+        for type, lexeme, _, _, lineno, column, width in self.scan():
+            if lexeme is None:
+                yield Token(type, type.value, lineno, column, width)
+            elif type is TokenType.TK_IDENT:
+                yield Token(type, to_str(lexeme), lineno, column, width)
+            else:
+                yield Token(type, int(lexeme), lineno, column, width)
+        while True:
+            yield Token(type=TokenType.TK_EOF, value=None)
+
+    def get_next_token(self):
+        return next(self._stream)
+
+    def gather_all_tokens(self):
+        token = self.get_next_token()
+        self.tokens.append(token)
+        while token.type != TokenType.TK_EOF:
+            token = self.get_next_token()
+            self.tokens.append(token)
+        return self.tokens
+
+
+class TokenBuffer:
+    """Struct-of-arrays storage for a whole token stream.
+
+    Each token costs one entry in six typed arrays (type id, start and end
+    offsets into the source, lineno, column, width) instead of a Token
+    object and its value.  Token objects and their values are materialized
+    on demand; get_next_token() lets the Parser consume the buffer exactly
+    like a lexer.
+    """
+    _types = list(TokenType)
+    _type_ids = {type: i for i, type in enumerate(_types)}
+
+    def __init__(self, text, start=0, stop=None, lineno=1):
+        self.text = text
+        self.type_ids = array('B')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.linenos = array('i')
+        self.columns = array('i')
+        self.widths = array('i')
+        self.pos = 0
+        self._fill(TableLexer(text, start, stop, lineno))
+
+    def _fill(self, lexer):
+        type_ids = self._type_ids
+        append_type = self.type_ids.append
+        append_start = self.starts.append
+        append_end = self.ends.append
+        append_lineno = self.linenos.append
+        append_column = self.columns.append
+        append_width = self.widths.append
+        for type, _, start, end, lineno, column, width in lexer.scan():
+            append_type(type_ids[type])
+            append_start(start)
+            append_end(end)
+            append_lineno(lineno)
+            append_column(column)
+            append_width(width)
+
+    def __len__(self):
+        return len(self.type_ids)
+
+    def type(self, i):
+        return self._types[self.type_ids[i]]
+
+    def value(self, i):
+        type = self._types[self.type_ids[i]]
+        if type is TokenType.TK_IDENT or type is TokenType.TK_INTEGER_CONST:
+            lexeme = self.text[self.starts[i]:self.ends[i]]
+            if not isinstance(lexeme, str):
+                lexeme = lexeme.decode()
+            # an identifier spelled 'INTEGER_CONST' is lexed as that keyword
+            if type is TokenType.TK_INTEGER_CONST and lexeme.isdigit():
+                return int(lexeme)
+            return lexeme
+        return type.value
+
+    def __getitem__(self, i):
+        return Token(self.type(i), self.value(i), self.linenos[i], self.columns[i], self.widths[i])
+
+    def get_next_token(self):
+        if self.pos >= len(self.type_ids):
+            return Token(type=TokenType.TK_EOF, value=None)
+        token = self[self.pos]
+        self.pos += 1
+        return token
+
+    def gather_all_tokens(self):
+        tokens = [self[i] for i in range(len(self))]
+        tokens.append(Token(type=TokenType.TK_EOF, value=None))
+        return tokens
+
+
+# engines selectable with the '--lexer' command line option
+LEXERS = {
+    'char': Lexer,
+    'table': TableLexer,
+}
+
 ##################################################################################################
 #
 #   AST_Node type:
 #
 ##################################################################################################
 
+# Every node class declares its fields in __slots__, including the ones
+# filled in later by the passes (symbol, parameter_symbol, offset, label), so
+# nodes carry no per-instance __dict__.
 class AST_Node(metaclass=ABCMeta):
-    @abstractmethod
+    __slots__ = ()
+
     def accept(self, visitor):
-        pass
+        """Walk the subtree rooted at this node with `visitor`."""
+        visitor.visit(self)
 
 class UnaryOp_Node(AST_Node):
+    __slots__ = ('token', 'op', 'right')
+
     def __init__(self, op, right):
         self.token = self.op = op
         self.right = right
-    def accept(self, visitor):
-        visitor.visit_UnaryOp_Node(self)
 
 class If_Node(AST_Node):
+    __slots__ = ('condition', 'then_statement', 'else_statement', 'label')
+
     def __init__(self, condition, then_statement, else_statement):
         self.condition = condition
         self.then_statement = then_statement
         self.else_statement = else_statement
-    def accept(self, visitor):
-        visitor.visit_If_Node(self)
+        self.label = 0
 
 class While_Node(AST_Node):
+    __slots__ = ('condition', 'statement', 'label')
+
     def __init__(self, condition, statement):
         self.condition = condition
         self.statement = statement
-    def accept(self, visitor):
-        visitor.visit_While_Node(self)
+        self.label = 0
 
 class Return_Node(AST_Node):
+    __slots__ = ('token', 'right', 'function_name')
+
     def __init__(self, tok, right, function_name):
         self.token = tok
         self.right = right
         self.function_name = function_name
-    def accept(self, visitor):
-        visitor.visit_Return_Node(self)
 
 class Block_Node(AST_Node):
+    __slots__ = ('ltoken', 'rtoken', 'statement_nodes')
+
     def __init__(self, ltok, rtok, statement_nodes):
         self.ltoken = ltok
         self.rtoken = rtok
         self.statement_nodes = statement_nodes
-    def accept(self, visitor):
-        visitor.visit_Block_Node(self)
 
 class BinaryOp_Node(AST_Node):
+    __slots__ = ('left', 'token', 'op', 'right')
+
     def __init__(self, left, op, right):
         self.left = left
         self.token = self.op = op
         self.right = right
-    def accept(self, visitor):
-        visitor.visit_BinaryOp_Node(self)
 
 class Assign_Node(AST_Node):
+    __slots__ = ('left', 'token', 'op', 'right')
+
     def __init__(self, left, op, right):
         self.left = left
         self.token = self.op = op
         self.right = right
-    def accept(self, visitor):
-        visitor.visit_Assign_Node(self)
 
 class FunctionCall_Node(AST_Node):
+    __slots__ = ('function_name', 'actual_parameter_nodes', 'token')
+
     def __init__(self, function_name, actual_parameter_nodes, token):
         self.function_name = function_name
         self.actual_parameter_nodes = actual_parameter_nodes
         self.token = token
-    def accept(self, visitor):
-        visitor.visit_FunctionCall_Node(self)
 
 class Num_Node(AST_Node):
+    __slots__ = ('token', 'value')
+
     def __init__(self, token):
         self.token = token
         self.value = token.value
-    def accept(self, visitor):
-        visitor.visit_Num_Node(self)
 
 class Var_Node(AST_Node):
     """The Var node is constructed out of ID token."""
+    __slots__ = ('token', 'name', 'array', 'symbol')
+
     def __init__(self, token, array = None):
         self.token = token
         self.name = token.value
         self.array = array
         self.symbol = None
-    def accept(self, visitor):
-        visitor.visit_Var_Node(self)
 
 class Var_array_item_Node(AST_Node):
+    __slots__ = ('token', 'index', 'array', 'symbol')
+
     def __init__(self, token, index):
         self.token = token
         self.index = index
         self.array = 'Yes'
-    def accept(self, visitor):
-        visitor.visit_Var_array_item_Node(self)
+        self.symbol = None
 
 class BasicType_Node(AST_Node):
+    __slots__ = ('token', 'value')
+
     def __init__(self, token):
         self.token = token
         self.value = token.value
-    def accept(self, visitor):
-        visitor.visit_BasicType_Node(self)
 
 class VarDecl_Node(AST_Node):
+    __slots__ = ('basictype_node', 'var_node')
+
     def __init__(self, basictype_node, var_node):
         self.basictype_node = basictype_node
         self.var_node = var_node
-    def accept(self, visitor):
-        visitor.visit_VarDecl_Node(self)
 
 class FormalParam_Node(AST_Node):
+    __slots__ = ('basictype_node', 'parameter_node', 'parameter_symbol')
+
     def __init__(self, basictype_node, parameter_node):
         self.basictype_node = basictype_node
         self.parameter_node = parameter_node
         self.parameter_symbol = None
-    def accept(self, visitor):
-        visitor.visit_FormalParam_Node(self)
 
 class FunctionDef_Node(AST_Node):
+    __slots__ = ('basictype_node', 'function_name', 'formal_parameters', 'block_node', 'offset',
+                 'labels')
+
     def __init__(self, basictype_node, function_name, formal_parameters, block_node):
         self.basictype_node = basictype_node
         self.function_name = function_name
         self.formal_parameters = formal_parameters
         self.block_node = block_node
         self.offset = 0
-    def accept(self, visitor):
-        visitor.visit_FunctionDef_Node(self)
+        self.labels = 0
 
 
 
@@ -404,7 +721,66 @@ class FunctionDef_Node(AST_Node):
 #
 ##################################################################################################
 
+# returned by next() once a visit_X_Node generator is exhausted
+_DONE = object()
+
 class NodeVisitor(metaclass=ABCMeta):
+    """Base of the AST passes.
+
+    visit_X_Node(node) handles nodes of class X.  A method that needs the
+    children of its node visited is written as a generator that yields
+    each child at the point where it must be visited, e.g.
+
+        def visit_BinaryOp_Node(self, node):
+            yield node.right
+            print("    push %rax")
+            yield node.left
+
+    visit() runs those generators on an explicit stack instead of the
+    Python call stack, so the depth of the AST is not limited by the
+    recursion limit.  Methods without children may simply return.
+    """
+
+    @classmethod
+    def _visit_methods(cls):
+        # per visitor class: node class -> visit_X_Node function,
+        # each entry filled in the first time that node class is met
+        methods = cls.__dict__.get('_visit_method_table')
+        if methods is None:
+            methods = cls._visit_method_table = {}
+        return methods
+
+    def visit(self, node):
+        """Visit the subtree rooted at `node` without recursion."""
+        methods = self._visit_methods()
+        lookup = methods.get
+        # generators of the nodes whose children are being visited
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        done = _DONE
+        child = node
+        while True:
+            method = lookup(child.__class__)
+            if method is None:
+                method = methods[child.__class__] = \
+                    getattr(type(self), f'visit_{child.__class__.__name__}')
+            walker = method(self, child)
+            if walker is not None:
+                # go straight down to the first child
+                child = next(walker, done)
+                if child is not done:
+                    push(walker)
+                    continue
+            # resume the innermost walker that still has a child to visit
+            while stack:
+                child = next(stack[-1], done)
+                if child is not done:
+                    break
+                pop()
+            else:
+                return
+
     @abstractmethod
     def visit_UnaryOp_Node(self, node):
         pass
@@ -670,7 +1046,7 @@ class Parser:
             if self.current_token.type == TokenType.TK_SEMICOLON:
                 self.eat(TokenType.TK_SEMICOLON)
             else:
-                Error.show_error_at(token.lineno, token.column - token.width + 1, "expect \";\"")
+                raise ParserError("expect \";\"", token.lineno, token.column - token.width + 1)
         return node
 
     # statement := expression-statement
@@ -763,8 +1139,7 @@ class Parser:
                                         array_items.append(self.current_token.value)
                                         self.eat(TokenType.TK_INTEGER_CONST)
                                     else:
-                                        print(f"array item error")
-                                        exit(1)
+                                        raise ParserError("array item error", token=self.current_token)
                             self.eat(TokenType.TK_RBRACE)
                             value = {'size': array_size, 'items': array_items}
                             var_node = Var_Node(token, value)
@@ -829,8 +1204,7 @@ class Parser:
                 self.eat(TokenType.TK_COMMA)
                 formal_params.append(self.formal_parameter())
             else:
-                print(f"parameter list error")
-                exit(1)
+                raise ParserError("parameter list error", token=self.current_token)
         return formal_params
 
     # function_definition := type_specification identifier "(" formal_parameters? ")" block
@@ -850,8 +1224,8 @@ class Parser:
         if self.current_token.type == TokenType.TK_LBRACE:
             block_node = self.block()
         else:
-            Error.show_error_at(token.lineno, self.current_token.column - self.current_token.width,
-                                f"expect \"{TokenType.TK_LBRACE.value}\"")
+            raise ParserError(f"expect \"{TokenType.TK_LBRACE.value}\"", self.current_token.lineno,
+                              self.current_token.column - self.current_token.width)
 
         return FunctionDef_Node(basictype_node, function_name, formal_params, block_node)
 
@@ -895,6 +1269,104 @@ class Parser:
             )
         return function_definition_nodes
 
+
+class PrecedenceParser(Parser):
+    """Parser whose expressions are parsed by table-driven precedence climbing.
+
+    Builds the same BinaryOp_Node/UnaryOp_Node/Assign_Node trees as the
+    logic -> equality -> relational -> add_sub -> mul_div -> unary chain,
+    but with explicit operand/operator stacks: an operand costs one loop
+    iteration instead of seven nested calls, and neither parentheses nor
+    prefix operators nor assignments consume Python stack.
+    """
+    # binding power of each binary operator, higher binds tighter;
+    # all are left-associative except "=", which is right-associative
+    _binary_precedence = {
+        TokenType.TK_ASSIGN: 1,
+        TokenType.TK_AND: 2, TokenType.TK_OR: 2,
+        TokenType.TK_EQ: 3, TokenType.TK_NE: 3,
+        TokenType.TK_LT: 4, TokenType.TK_LE: 4, TokenType.TK_GT: 4, TokenType.TK_GE: 4,
+        TokenType.TK_PLUS: 5, TokenType.TK_MINUS: 5,
+        TokenType.TK_MUL: 6, TokenType.TK_DIV: 6,
+    }
+    _unary_operators = (TokenType.TK_PLUS, TokenType.TK_MINUS, TokenType.TK_NOT)
+    # prefix operators bind tighter than any binary operator;
+    # an open parenthesis on the stack is never reduced
+    _UNARY = 7
+    _PAREN = 0
+
+    def _reduce(self, operands, operators):
+        precedence, token = operators.pop()
+        right = operands.pop()
+        if precedence == self._UNARY:
+            operands.append(UnaryOp_Node(op=token, right=right))
+        elif token.type == TokenType.TK_ASSIGN:
+            operands.append(Assign_Node(left=operands.pop(), op=token, right=right))
+        else:
+            operands.append(BinaryOp_Node(left=operands.pop(), op=token, right=right))
+
+    # expression := logic ("=" expression)?, see Parser for the other levels
+    def expression(self):
+        binary_precedence = self._binary_precedence
+        unary_operators = self._unary_operators
+        UNARY, PAREN = self._UNARY, self._PAREN
+        operands = []
+        # (precedence, token) pairs
+        operators = []
+        open_parens = 0
+        get_next_token = self.get_next_token
+        while True:
+            # expecting an operand, possibly behind prefix operators and "("
+            # (tokens whose type was just checked are eaten directly)
+            token = self.current_token
+            if token.type in unary_operators:
+                self.current_token = get_next_token()
+                operators.append((UNARY, token))
+                continue
+            if token.type == TokenType.TK_LPAREN:
+                self.current_token = get_next_token()
+                operators.append((PAREN, token))
+                open_parens += 1
+                continue
+            if token.type == TokenType.TK_INTEGER_CONST:
+                self.current_token = get_next_token()
+                operands.append(Num_Node(token))
+            else:
+                operands.append(self.primary())
+
+            # expecting ")", a binary operator or the end of the expression
+            token = self.current_token
+            while token.type == TokenType.TK_RPAREN and open_parens:
+                while operators[-1][0] != PAREN:
+                    self._reduce(operands, operators)
+                operators.pop()
+                open_parens -= 1
+                token = self.current_token = get_next_token()
+            precedence = binary_precedence.get(token.type)
+            if precedence is None:
+                break
+            # "=" is right-associative: an "=" already on the stack stays
+            while operators and (operators[-1][0] > precedence or
+                                 operators[-1][0] == precedence and
+                                 token.type != TokenType.TK_ASSIGN):
+                self._reduce(operands, operators)
+            self.current_token = get_next_token()
+            operators.append((precedence, token))
+
+        while operators:
+            if operators[-1][0] == PAREN:
+                # unbalanced "(", fails just like Parser.primary would
+                self.eat(TokenType.TK_RPAREN)
+            self._reduce(operands, operators)
+        return operands[-1]
+
+
+# parsers selectable with the '--parser' command line option
+PARSERS = {
+    'recursive': Parser,
+    'climbing': PrecedenceParser,
+}
+
 ##################################################################################################
 #
 #  SYMBOLS, TABLES, SEMANTIC ANALYSIS
@@ -949,9 +1421,13 @@ class ScopedSymbolTable:
         if current_scope_only:
             return None
 
-        # recursively go up the chain and lookup the name
-        if self.enclosing_scope is not None:
-            return self.enclosing_scope.lookup(name)
+        # go up the chain and lookup the name, one scope after another
+        scope = self.enclosing_scope
+        while scope is not None:
+            symbol = scope._symbols.get(name)
+            if symbol is not None:
+                return symbol
+            scope = scope.enclosing_scope
 
 
 ##################################################################################################
@@ -961,7 +1437,8 @@ class ScopedSymbolTable:
 ##################################################################################################
 
 class SemanticAnalyzer(NodeVisitor):
-    def __init__(self):
+    def __init__(self, context=None):
+        self.context = CompileContext() if context is None else context
         self.current_scope = None
         global_scope = ScopedSymbolTable(
             scope_name='global',
@@ -973,37 +1450,41 @@ class SemanticAnalyzer(NodeVisitor):
         self.current_scope = global_scope
 
     def log(self, msg):
-        if _SHOULD_LOG_SCOPE:
+        if self.context.log_scope:
             print(msg)
 
     def visit_UnaryOp_Node(self, node):
-        node.right.accept(self)
+        yield node.right
 
     def visit_Return_Node(self, node):
-        node.right.accept(self)
+        yield node.right
 
     def visit_BinaryOp_Node(self, node):
-        node.left.accept(self)
-        node.right.accept(self)
+        yield node.left
+        yield node.right
 
     def visit_Assign_Node(self, node):
         # make sure the left side of assign is a varible
         # if node.left.token.type != TokenType.TK_IDENT:
         #     print(f"the left side of assign is not a variable", file=sys.stderr)
-        node.left.accept(self)
-        node.right.accept(self)
+        yield node.left
+        yield node.right
 
     def visit_If_Node(self, node):
-        node.condition.accept(self)
+        self.context.labels += 1
+        node.label = self.context.labels
+        yield node.condition
         if node.then_statement is not None:
-            node.then_statement.accept(self)
+            yield node.then_statement
         if node.else_statement is not None:
-            node.else_statement.accept(self)
+            yield node.else_statement
 
     def visit_While_Node(self, node):
-        node.condition.accept(self)
+        self.context.labels += 1
+        node.label = self.context.labels
+        yield node.condition
         if node.statement is not None:
-            node.statement.accept(self)
+            yield node.statement
 
     def visit_Block_Node(self, node):
         block_name= self.current_scope.scope_name + f' block' + \
@@ -1017,7 +1498,7 @@ class SemanticAnalyzer(NodeVisitor):
         )
         self.current_scope = block_scope
         for eachnode in node.statement_nodes:
-            eachnode.accept(self)
+            yield eachnode
 
         self.current_scope = self.current_scope.enclosing_scope
         self.log(f'LEAVE scope: {block_name}')
@@ -1029,18 +1510,18 @@ class SemanticAnalyzer(NodeVisitor):
         array_name = node.token.value
         array_symbol = self.current_scope.lookup(array_name)
         if array_symbol is None:
-            print(f"semantic error, array variable not declared", file=sys.stderr)
-            sys.exit(1)
+            raise SemanticError("semantic error, array variable not declared",
+                                node.token.lineno, node.token.column - node.token.width)
         else:
             node.symbol = array_symbol
-            node.index.accept(self)
+            yield node.index
 
     def visit_Var_Node(self, node):
         var_name = node.name
         var_symbol = self.current_scope.lookup(var_name)
         if var_symbol is None:
-            print(f"semantic error, var not declared", file=sys.stderr)
-            sys.exit(1)
+            raise SemanticError("semantic error, var not declared",
+                                node.token.lineno, node.token.column - node.token.width)
         else:
             node.symbol = var_symbol
 
@@ -1048,30 +1529,32 @@ class SemanticAnalyzer(NodeVisitor):
         var_name = node.var_node.name
         var_basictype = node.basictype_node.value
         if node.var_node.array != None:  #array
-            Offset.sum += 8 * node.var_node.array['size']
-            var_offset = -Offset.sum
+            self.context.offset += 8 * node.var_node.array['size']
+            var_offset = -self.context.offset
             var_symbol = Var_Symbol(var_name, var_basictype, var_offset)
             node.var_node.symbol = var_symbol
             self.current_scope.insert(var_symbol)
         else:  # variable (not array)
-            Offset.sum += 8
-            var_offset = -Offset.sum
+            self.context.offset += 8
+            var_offset = -self.context.offset
             var_symbol = Var_Symbol(var_name, var_basictype, var_offset)
+            node.var_node.symbol = var_symbol
             self.current_scope.insert(var_symbol)
 
 
     def visit_FormalParam_Node(self, node):
         parameter_name = node.parameter_node.name
         parameter_type = node.basictype_node.value
-        Offset.sum += 8
-        parameter_offset = -Offset.sum
+        self.context.offset += 8
+        parameter_offset = -self.context.offset
         parameter_symbol = Parameter_Symbol(parameter_name, parameter_type, parameter_offset)
         self.current_scope.insert(parameter_symbol)
         node.parameter_symbol = parameter_symbol
 
     def visit_FunctionDef_Node(self, node):
         # leon: initialize the offset for each function
-        Offset.sum = 0
+        self.context.offset = 0
+        self.context.labels = 0
         function_name = node.function_name
         function_symbol = Function_Symbol(function_name)
         self.current_scope.insert(function_symbol)
@@ -1087,11 +1570,12 @@ class SemanticAnalyzer(NodeVisitor):
 
         # Insert formal_parameters into the function scope
         for eachparam in node.formal_parameters:
-            eachparam.accept(self)
+            yield eachparam
 
-        node.block_node.accept(self) # visit function block
+        yield node.block_node # visit function block
 
-        node.offset = Offset.sum
+        node.offset = self.context.offset
+        node.labels = self.context.labels
 
         self.current_scope = self.current_scope.enclosing_scope
         # self.log(f'LEAVE scope: {function_name}')
@@ -1100,7 +1584,8 @@ class SemanticAnalyzer(NodeVisitor):
         function_symbol.block_ast = node.block_node
 
     def visit_FunctionCall_Node(self, node):
-        pass
+        for eachnode in node.actual_parameter_nodes:
+            yield eachnode
 
     def semantic_analyze(self, tree):
         # Traverse the AST to construct symbol table.
@@ -1109,7 +1594,588 @@ class SemanticAnalyzer(NodeVisitor):
         #         self.visit(node)
         for node in tree:
             if node is not None:
-                node.accept(self)
+                self.visit(node)
+
+
+##################################################################################################
+#
+#  CONSTANT-FOLDER
+#
+##################################################################################################
+
+def _wrap(value):
+    """`value` as the 64-bit two's complement integer the machine computes."""
+    return (value + 2**63) % 2**64 - 2**63
+
+def _divide(dividend, divisor):
+    """idiv: the quotient truncated toward zero, None where it would trap."""
+    if divisor == 0 or dividend == -2**63 and divisor == -1:
+        return None
+    quotient = abs(dividend) // abs(divisor)
+    return -quotient if (dividend < 0) != (divisor < 0) else quotient
+
+_folds = {
+    TokenType.TK_PLUS: lambda a, b: _wrap(a + b),
+    TokenType.TK_MINUS: lambda a, b: _wrap(a - b),
+    TokenType.TK_MUL: lambda a, b: _wrap(a * b),
+    TokenType.TK_DIV: _divide,
+    TokenType.TK_AND: lambda a, b: a & b,
+    TokenType.TK_OR: lambda a, b: a | b,
+    TokenType.TK_EQ: lambda a, b: int(a == b),
+    TokenType.TK_NE: lambda a, b: int(a != b),
+    TokenType.TK_LT: lambda a, b: int(a < b),
+    TokenType.TK_GT: lambda a, b: int(a > b),
+    TokenType.TK_LE: lambda a, b: int(a <= b),
+    TokenType.TK_GE: lambda a, b: int(a >= b),
+}
+
+
+# the operators --short-circuit evaluates with jumps
+_logical_operators = frozenset((TokenType.TK_AND, TokenType.TK_OR))
+# comparison -> the conditional jumps taken when it is true and when it is false
+_conditional_jumps = {
+    TokenType.TK_EQ: ('je', 'jne'), TokenType.TK_NE: ('jne', 'je'),
+    TokenType.TK_LT: ('jl', 'jge'), TokenType.TK_GT: ('jg', 'jle'),
+    TokenType.TK_LE: ('jle', 'jg'), TokenType.TK_GE: ('jge', 'jl'),
+}
+
+def is_logical(node, context):
+    """Whether `node` is an && or || that `context` evaluates with jumps."""
+    return (context.short_circuit and type(node) is BinaryOp_Node
+            and node.op.type in _logical_operators)
+
+
+def constant_value(node):
+    """The value of `node` if it is a Num_Node, else None."""
+    if type(node) is not Num_Node:
+        return None
+    if node.value == 'true':
+        return 1
+    if node.value == 'false':
+        return 0
+    return node.value
+
+def make_num(value, token):
+    """A Num_Node of `value`, at the place of `token`."""
+    return Num_Node(Token(TokenType.TK_INTEGER_CONST, value, token.lineno, token.column))
+
+
+def assigned_symbols(node):
+    """The symbols of the scalar variables assigned anywhere in `node`."""
+    symbols = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        cls = type(node)
+        if cls is Assign_Node:
+            if node.left.array is None:
+                symbols.add(node.left.symbol)
+            else:
+                stack.append(node.left.index)
+            stack.append(node.right)
+        elif cls is BinaryOp_Node:
+            stack.append(node.left)
+            stack.append(node.right)
+        elif cls is UnaryOp_Node or cls is Return_Node:
+            stack.append(node.right)
+        elif cls is Var_array_item_Node:
+            stack.append(node.index)
+        elif cls is FunctionCall_Node:
+            stack.extend(node.actual_parameter_nodes)
+        elif cls is Block_Node:
+            stack.extend(node.statement_nodes)
+        elif cls is If_Node:
+            stack.extend((node.condition, node.then_statement, node.else_statement))
+        elif cls is While_Node:
+            stack.extend((node.condition, node.statement))
+    symbols.discard(None)
+    return symbols
+
+
+class ConstantFolder(NodeVisitor):
+    """Folds constants in the analyzed AST (-O1).
+
+      * BinaryOp_Node and UnaryOp_Node subtrees of constants become a
+        Num_Node of their value, computed as the generated code would
+        (64-bit wrap-around; a division that would trap is kept).
+      * A scalar variable read where its value is known, from an
+        assignment of a constant earlier on every path to it, becomes
+        that constant.  Calls cannot change locals, an if merges the
+        values both arms agree on, and a while forgets every variable
+        assigned anywhere in it.
+      * An if or while whose condition is constant is replaced by the
+        statements that run: the condition value as an expression
+        statement (the value a function falling off its end returns)
+        and the arm taken, or nothing for a while(0) body.
+
+    Every visit leaves the node replacing the visited one in self.node;
+    the parents put it in place of the child.
+    """
+    def __init__(self, context=None):
+        self.context = CompileContext() if context is None else context
+        # symbol -> the constant value that variable holds here
+        self.constants = {}
+        self.node = None
+
+    def fold(self, tree):
+        for node in tree:
+            if node is not None:
+                self.visit(node)
+
+    def visit_UnaryOp_Node(self, node):
+        self.node = node
+        if node.op.type == TokenType.TK_PLUS:
+            # the code generators leave unary plus alone, operand and all
+            return
+        yield node.right
+        node.right = self.node
+        value = constant_value(node.right)
+        if value is not None:
+            if node.op.type == TokenType.TK_MINUS:
+                node = make_num(_wrap(-value), node.token)
+            elif node.op.type == TokenType.TK_NOT:
+                node = make_num(~value, node.token)
+        self.node = node
+
+    def visit_Return_Node(self, node):
+        if node.right is not None:
+            yield node.right
+            node.right = self.node
+        self.node = node
+
+    def visit_BinaryOp_Node(self, node):
+        if is_logical(node, self.context):
+            yield from self.fold_logical(node)
+            return
+        # right first, as the code is generated
+        yield node.right
+        node.right = self.node
+        yield node.left
+        node.left = self.node
+        self.node = node
+        left = constant_value(node.left)
+        right = constant_value(node.right)
+        if left is not None and right is not None:
+            value = _folds[node.op.type](left, right)
+            if value is not None:
+                self.node = make_num(value, node.token)
+
+    def fold_condition(self, node):
+        if is_logical(node, self.context):
+            yield from self.fold_logical(node, True)
+        else:
+            yield node
+
+    def fold_logical(self, node, condition=False):
+        # Left first, and the right operand only if the left one does not
+        # decide.  As a value, && and || are 0 or 1; as the condition of an
+        # if or while they jump on their operands, leaving the value of the
+        # last one evaluated behind, so they fold to that operand.
+        yield from self.fold_condition(node.left) if condition else [node.left]
+        node.left = self.node
+        left = constant_value(node.left)
+        is_and = node.op.type == TokenType.TK_AND
+        if left is not None and (left == 0) == is_and:
+            self.node = node.left if condition else make_num(int(not is_and), node.token)
+            return
+        before = dict(self.constants)
+        yield from self.fold_condition(node.right) if condition else [node.right]
+        node.right = self.node
+        # the right operand may not have run
+        self.constants = {symbol: value for symbol, value in self.constants.items()
+                          if before.get(symbol) == value}
+        right = constant_value(node.right)
+        self.node = node
+        if left is not None and right is not None:
+            self.node = node.right if condition else make_num(int(right != 0), node.token)
+
+    def visit_Assign_Node(self, node):
+        left = node.left
+        if left.array is not None:
+            yield left.index
+            left.index = self.node
+        yield node.right
+        node.right = self.node
+        if left.array is None:
+            value = constant_value(node.right)
+            if value is None:
+                self.constants.pop(left.symbol, None)
+            else:
+                self.constants[left.symbol] = value
+        self.node = node
+
+    def visit_Num_Node(self, node):
+        self.node = node
+
+    def visit_If_Node(self, node):
+        yield from self.fold_condition(node.condition)
+        node.condition = self.node
+        condition = constant_value(node.condition)
+        if condition is not None:
+            arm = node.then_statement if condition else node.else_statement
+            statements = [node.condition]
+            if arm is not None:
+                yield arm
+                if self.node is not None:
+                    statements.append(self.node)
+            self.node = Block_Node(None, None, statements)
+            return
+        before = dict(self.constants)
+        if node.then_statement is not None:
+            yield node.then_statement
+            node.then_statement = self.node
+        after_then = self.constants
+        self.constants = before
+        if node.else_statement is not None:
+            yield node.else_statement
+            node.else_statement = self.node
+        self.constants = {symbol: value for symbol, value in self.constants.items()
+                          if after_then.get(symbol) == value}
+        self.node = node
+
+    def visit_While_Node(self, node):
+        for symbol in assigned_symbols(node):
+            self.constants.pop(symbol, None)
+        yield from self.fold_condition(node.condition)
+        node.condition = self.node
+        condition = constant_value(node.condition)
+        if condition == 0:
+            self.node = Block_Node(None, None, [node.condition])
+            return
+        if node.statement is not None:
+            before = dict(self.constants)
+            yield node.statement
+            node.statement = self.node
+            self.constants = before
+        self.node = node
+
+    def visit_Block_Node(self, node):
+        statements = []
+        for eachnode in node.statement_nodes:
+            yield eachnode
+            if self.node is not None:
+                statements.append(self.node)
+        node.statement_nodes = statements
+        self.node = node
+
+    def visit_Var_array_item_Node(self, node):
+        yield node.index
+        node.index = self.node
+        self.node = node
+
+    def visit_Var_Node(self, node):
+        value = self.constants.get(node.symbol)
+        self.node = node if value is None else make_num(value, node.token)
+
+    def visit_VarDecl_Node(self, node):
+        self.node = node
+
+    def visit_FormalParam_Node(self, node):
+        self.node = node
+
+    def visit_FunctionDef_Node(self, node):
+        self.constants = {}
+        yield node.block_node
+        node.block_node = self.node
+        self.node = node
+
+    def visit_FunctionCall_Node(self, node):
+        arguments = node.actual_parameter_nodes
+        for i, eachnode in enumerate(arguments):
+            yield eachnode
+            arguments[i] = self.node
+        self.node = node
+
+
+##################################################################################################
+#
+#  DEAD-CODE-ELIMINATOR
+#
+##################################################################################################
+
+# the nodes that are expression statements where they occur as statements
+_expression_nodes = frozenset((UnaryOp_Node, BinaryOp_Node, Assign_Node, FunctionCall_Node,
+                               Num_Node, Var_Node, Var_array_item_Node))
+
+
+def has_effects(node):
+    """Whether evaluating expression `node` can do more than give its value:
+    assign, call, or trap in a division."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        cls = type(node)
+        if cls is Assign_Node or cls is FunctionCall_Node:
+            return True
+        if cls is BinaryOp_Node:
+            if node.op.type == TokenType.TK_DIV and constant_value(node.right) in (None, 0, -1):
+                return True
+            stack.append(node.left)
+            stack.append(node.right)
+        elif cls is UnaryOp_Node:
+            stack.append(node.right)
+        elif cls is Var_array_item_Node:
+            stack.append(node.index)
+    return False
+
+
+def replaces_value(node):
+    """Whether statement `node` leaves a new value for a function falling
+    off its end to return, before anything else runs."""
+    while type(node) is Block_Node:
+        if not node.statement_nodes:
+            return False
+        node = node.statement_nodes[0]
+    if type(node) is Return_Node:
+        return node.right is not None
+    # an if or while evaluates its condition first
+    return type(node) in _expression_nodes or type(node) is If_Node or type(node) is While_Node
+
+
+def called_functions(node):
+    """The names of the functions called anywhere in `node`."""
+    names = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        cls = type(node)
+        if cls is FunctionCall_Node:
+            names.add(node.function_name)
+            stack.extend(node.actual_parameter_nodes)
+        elif cls is Assign_Node or cls is BinaryOp_Node:
+            stack.append(node.left)
+            stack.append(node.right)
+        elif cls is UnaryOp_Node or cls is Return_Node:
+            stack.append(node.right)
+        elif cls is Var_array_item_Node:
+            stack.append(node.index)
+        elif cls is Block_Node:
+            stack.extend(node.statement_nodes)
+        elif cls is If_Node:
+            stack.extend((node.condition, node.then_statement, node.else_statement))
+        elif cls is While_Node:
+            stack.extend((node.condition, node.statement))
+        elif cls is FunctionDef_Node:
+            stack.append(node.block_node)
+    return names
+
+
+def called_from_main(functions):
+    """The `functions` a chain of calls from main reaches, in source order;
+    all of them when there is no main."""
+    by_name = {node.function_name: node for node in functions}
+    if 'main' not in by_name:
+        return list(functions)
+    reached = {'main'}
+    stack = [by_name['main']]
+    while stack:
+        for name in called_functions(stack.pop()):
+            if name not in reached and name in by_name:
+                reached.add(name)
+                stack.append(by_name[name])
+    return [node for node in functions if node.function_name in reached]
+
+
+def instruction_counts(context, functions):
+    """{function name: number of instructions generated for it} (--opt-report)."""
+    counting = CompileContext(optimize=context.optimize, backend=context.backend,
+                              short_circuit=context.short_circuit)
+    counts = {}
+    for node in functions:
+        emitter = Emitter()
+        BACKENDS[counting.backend](emitter, counting).visit(node)
+        counts[node.function_name] = sum(type(line) is Instruction and line.op[0] != '.'
+                                         for line in emitter.lines)
+    return counts
+
+
+class DeadCodeEliminator(NodeVisitor):
+    """Removes the code that never runs or whose value is never used (-O1).
+
+      * The statements of a block after a return never run.
+      * An expression statement without effects (see has_effects()) only
+        leaves its value for a function falling off its end to return.
+        It is removed where a later statement certainly replaces that
+        value first (replaces_value()): in a function with a return at
+        its top level, everywhere.
+      * A function no chain of calls from main reaches is removed.  That
+        needs the whole program, which a --chunk-jobs run does not see.
+
+    Like the ConstantFolder, every statement visit leaves the node that
+    replaces it in self.node, None for no statement; expressions are not
+    visited below the statement.
+    """
+    def __init__(self, context=None):
+        self.context = CompileContext() if context is None else context
+        # whether the function being visited returns at its top level
+        self.returns = False
+        # whether the value the statement being visited leaves is replaced
+        # before the function could fall off its end
+        self.replaced = False
+        self.node = None
+
+    def eliminate(self, tree, whole_program=True):
+        """Return the functions of `tree` to generate, without dead code."""
+        functions = [node for node in tree if node is not None]
+        report = self.context.opt_report
+        if report:
+            before = instruction_counts(self.context, functions)
+        if whole_program:
+            functions = called_from_main(functions)
+        for node in functions:
+            self.visit(node)
+        if report:
+            after = instruction_counts(self.context, functions)
+            for name, count in before.items():
+                if name not in after:
+                    print(f"{name}: not called from main, removed {count} instructions",
+                          file=sys.stderr)
+                else:
+                    print(f"{name}: dead code elimination removed {count - after[name]} "
+                          f"of {count} instructions", file=sys.stderr)
+            print(f"dead code elimination removed "
+                  f"{sum(before.values()) - sum(after.values())} instructions in total",
+                  file=sys.stderr)
+        return functions
+
+    def visit_expression(self, node):
+        self.node = None if self.replaced and not has_effects(node) else node
+
+    visit_UnaryOp_Node = visit_BinaryOp_Node = visit_Assign_Node = visit_expression
+    visit_FunctionCall_Node = visit_Num_Node = visit_Var_Node = visit_expression
+    visit_Var_array_item_Node = visit_expression
+
+    def visit_Return_Node(self, node):
+        self.node = node
+
+    def visit_If_Node(self, node):
+        replaced = self.replaced
+        if node.then_statement is not None:
+            yield node.then_statement
+            node.then_statement = self.node
+        if node.else_statement is not None:
+            self.replaced = replaced
+            yield node.else_statement
+            node.else_statement = self.node
+        self.node = node
+
+    def visit_While_Node(self, node):
+        if node.statement is not None:
+            # the condition runs after the body
+            self.replaced = True
+            yield node.statement
+            node.statement = self.node
+        self.node = node
+
+    def visit_Block_Node(self, node):
+        replaced = self.replaced
+        statements = node.statement_nodes
+        for i, eachnode in enumerate(statements):
+            if type(eachnode) is Return_Node:
+                statements = statements[:i + 1]
+                break
+        kept = []
+        for i, eachnode in enumerate(statements):
+            if i + 1 < len(statements):
+                self.replaced = self.returns or replaces_value(statements[i + 1])
+            else:
+                self.replaced = replaced
+            yield eachnode
+            if self.node is not None:
+                kept.append(self.node)
+        node.statement_nodes = kept
+        self.node = node
+
+    def visit_VarDecl_Node(self, node):
+        self.node = node
+
+    def visit_FormalParam_Node(self, node):
+        self.node = node
+
+    def visit_FunctionDef_Node(self, node):
+        self.returns = any(type(eachnode) is Return_Node and eachnode.right is not None
+                           for eachnode in node.block_node.statement_nodes)
+        self.replaced = self.returns
+        yield node.block_node
+        self.node = node
+
+
+##################################################################################################
+#
+#  FRAME-LAYOUT
+#
+##################################################################################################
+
+class FrameLayout(NodeVisitor):
+    """Lays out the frame of every function again, sharing slots (-O1).
+
+    The SemanticAnalyzer gives each parameter and variable a slot of its
+    own, so a frame grows with all the declarations of its function.  A
+    variable only lives until the end of its block, though: here the
+    slots of a block are given back when it ends, so sibling blocks
+    ({int b; ...} {int c; ...}) use the same slots and a frame is only as
+    large as its deepest nest of blocks needs.  The slots are taken in
+    the same order as before, so a function without nested declarations
+    keeps its layout.  Node.offset and the symbols' offsets are updated.
+    """
+    def __init__(self, context=None):
+        self.context = CompileContext() if context is None else context
+        # bytes of the frame in use at this point of the function
+        self.offset = 0
+        # the most in use anywhere in the function so far
+        self.size = 0
+
+    def lay_out(self, tree):
+        for node in tree:
+            if node is not None:
+                self.visit(node)
+
+    def allocate(self, symbol, size):
+        self.offset += size
+        self.size = max(self.size, self.offset)
+        symbol.offset = -self.offset
+
+    def visit_FunctionDef_Node(self, node):
+        self.offset = 0
+        self.size = 0
+        for eachparam in node.formal_parameters:
+            yield eachparam
+        yield node.block_node
+        if self.context.opt_report:
+            print(f"{node.function_name}: frame layout shrank the frame from {node.offset} "
+                  f"to {self.size} bytes", file=sys.stderr)
+        node.offset = self.size
+
+    def visit_FormalParam_Node(self, node):
+        self.allocate(node.parameter_symbol, 8)
+
+    def visit_VarDecl_Node(self, node):
+        var_node = node.var_node
+        self.allocate(var_node.symbol, 8 if var_node.array is None else 8 * var_node.array['size'])
+
+    def visit_Block_Node(self, node):
+        offset = self.offset
+        for eachnode in node.statement_nodes:
+            yield eachnode
+        self.offset = offset
+
+    def visit_If_Node(self, node):
+        if node.then_statement is not None:
+            yield node.then_statement
+        if node.else_statement is not None:
+            yield node.else_statement
+
+    def visit_While_Node(self, node):
+        if node.statement is not None:
+            yield node.statement
+
+    def visit_expression(self, node):
+        # no declarations below a statement that is not a block, if or while
+        pass
+
+    visit_UnaryOp_Node = visit_BinaryOp_Node = visit_Assign_Node = visit_expression
+    visit_FunctionCall_Node = visit_Num_Node = visit_Var_Node = visit_expression
+    visit_Var_array_item_Node = visit_Return_Node = visit_expression
 
 
 ##################################################################################################
@@ -1118,67 +2184,314 @@ class SemanticAnalyzer(NodeVisitor):
 #
 ##################################################################################################
 
+class Instruction:
+    """One instruction or directive of the generated code.
+
+    `op` is the mnemonic, or a directive such as '.text', and `operands`
+    are its AT&T operands, source first: Instruction('mov', '$1', '%rax')
+    is printed as "    mov $1, %rax".
+    """
+    __slots__ = ('op', 'operands', 'text')
+
+    # printed other than as the bare mnemonic, as they always were
+    _spellings = {'je': 'je '}
+
+    def __init__(self, op, *operands):
+        self.op = op
+        self.operands = operands
+        # the line of assembly, formatted once
+        if operands:
+            self.text = f"    {self._spellings.get(op, op)} {', '.join(operands)}"
+        else:
+            self.text = f"    {op}"
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f"Instruction({', '.join(map(repr, (self.op,) + self.operands))})"
+
+
+class Label:
+    """A label definition: Label('.L.else.3') is printed as ".L.else.3:"."""
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return f"{self.name}:"
+
+    def __repr__(self):
+        return f"Label({self.name!r})"
+
+
+class Emitter:
+    """Collects the generated code and writes it out in large chunks.
+
+    The code is a list of Instruction and Label objects (or strings of
+    finished assembly), which the peephole optimizer can rewrite before
+    it is printed.  emit() is the bound append of that list; flush()
+    writes everything collected so far to `file` with a single write().
+    Without a file the code is kept, and getvalue() returns it as one
+    string.
+    """
+    def __init__(self, file=None):
+        self.file = file
+        self.lines = []
+        self.emit = self.lines.append
+
+    def flush(self):
+        if self.file is not None and self.lines:
+            self.file.write('\n'.join(map(str, self.lines)))
+            self.file.write('\n')
+            self.lines.clear()
+
+    def getvalue(self):
+        return ''.join(f"{line}\n" for line in self.lines)
+
+
+# -O1 initializes arrays of at least this many items with rep movsq and
+# rep stosq from a .rodata copy, instead of storing each item
+BULK_INITIALIZATION = 16
+
+
+def initialized_items(size, items):
+    """How many of the `size` items of an array initialized with `items` are
+    not 0: the ones after the last that is not are left for a zero fill."""
+    copied = min(size, len(items))
+    while copied and items[copied - 1] == 0:
+        copied -= 1
+    return copied
+
+
 class Codegenerator(NodeVisitor):
+    # An emitted Instruction is never changed, so the ones that never
+    # vary are built once, here, and shared.
+    _add_rdi_rax = Instruction('add', '%rdi', '%rax')
+    _and_rdi_rax = Instruction('and', '%rdi', '%rax')
+    _cmp_0_rax = Instruction('cmp', '$0', '%rax')
+    _cmp_rdi_rax = Instruction('cmp', '%rdi', '%rax')
+    _cqo = Instruction('cqo')
+    _idiv_rdi = Instruction('idiv', '%rdi')
+    _imul_8_rax = Instruction('imul', '$8', '%rax')
+    _imul_rdi_rax = Instruction('imul', '%rdi', '%rax')
+    _mov_0_rax = Instruction('mov', '$0', '%rax')
+    _mov_1_rax = Instruction('mov', '$1', '%rax')
+    _mov_at_rax_rax = Instruction('mov', '(%rax)', '%rax')
+    _mov_rax_at_rdi = Instruction('mov', '%rax', '(%rdi)')
+    _mov_rbp_rsp = Instruction('mov', '%rbp', '%rsp')
+    _mov_rdi_at_rax = Instruction('mov', '%rdi', '(%rax)')
+    _mov_rsp_rbp = Instruction('mov', '%rsp', '%rbp')
+    _movzb_al_rax = Instruction('movzb', '%al', '%rax')
+    _neg_rax = Instruction('neg', '%rax')
+    _not_rax = Instruction('not', '%rax')
+    _or_rdi_rax = Instruction('or', '%rdi', '%rax')
+    _pop_rbp = Instruction('pop', '%rbp')
+    _pop_rdi = Instruction('pop', '%rdi')
+    _push_rax = Instruction('push', '%rax')
+    _push_rbp = Instruction('push', '%rbp')
+    _rep_movsq = Instruction('rep', 'movsq')
+    _rep_stosq = Instruction('rep', 'stosq')
+    _ret = Instruction('ret')
+    _rodata = Instruction('.section', '.rodata')
+    _align_8 = Instruction('.p2align', '3')
+    _sete_al = Instruction('sete', '%al')
+    _setg_al = Instruction('setg', '%al')
+    _setge_al = Instruction('setge', '%al')
+    _setl_al = Instruction('setl', '%al')
+    _setle_al = Instruction('setle', '%al')
+    _setne_al = Instruction('setne', '%al')
+    _sub_1_rax = Instruction('sub', '$1', '%rax')
+    _sub_rdi_rax = Instruction('sub', '%rdi', '%rax')
+    _text = Instruction('.text')
+
+    def __init__(self, emitter=None, context=None):
+        self.context = CompileContext() if context is None else context
+        self.emitter = Emitter(sys.stdout) if emitter is None else emitter
+        self.emit = self.emitter.emit
+
     # Round up `n` to the nearest multiple of `align`. For instance,
     # align_to(5, 8) returns 8 and align_to(11, 8) returns 16.
     def align_to(self, n, align):
       return int((n + align - 1) / align) * align
 
+    def copy_data(self, offset, label, count):
+        """Copy `count` quadwords from .rodata `label` to frame `offset`."""
+        self.emit(Instruction('lea', f'{label}(%rip)', '%rsi'))
+        self.emit(Instruction('lea', f'{offset}(%rbp)', '%rdi'))
+        self.emit(Instruction('mov', f'${count}', '%rcx'))
+        self.emit(self._rep_movsq)
+
+    def zero_fill(self, offset, count):
+        """Store 0 in the `count` quadwords from frame `offset` on."""
+        self.emit(Instruction('lea', f'{offset}(%rbp)', '%rdi'))
+        self.emit(self._mov_0_rax)
+        self.emit(Instruction('mov', f'${count}', '%rcx'))
+        self.emit(self._rep_stosq)
+
+    def emit_data(self, data):
+        """Emit the (label, items) arrays copied from, after the function."""
+        if not data:
+            return
+        self.emit(self._rodata)
+        for label, items in data:
+            self.emit(self._align_8)
+            self.emit(Label(label))
+            for i in range(0, len(items), 16):
+                self.emit(Instruction('.quad', *map(str, items[i:i + 16])))
+
     def visit_UnaryOp_Node(self, node):
         if node.op.type == TokenType.TK_MINUS:
-            node.right.accept(self)
-            print(f"    neg %rax")
+            yield node.right
+            self.emit(self._neg_rax)
         elif node.op.type == TokenType.TK_NOT:
-            node.right.accept(self)
-            print(f"    not %rax")
+            yield node.right
+            self.emit(self._not_rax)
 
     def visit_Return_Node(self, node):
-        node.right.accept(self)
+        yield node.right
         if node.token.type == TokenType.TK_RETURN:
-            print(f"    jmp .{node.function_name}.return")
+            self.emit(Instruction('jmp', f'.{node.function_name}.return'))
+
+    def new_label(self):
+        """A fresh label of the function being generated."""
+        self.local_labels += 1
+        return f'.{self.function_name}.sc.{self.local_labels}'
+
+    def fuses(self, node):
+        """Whether condition `node` is a comparison to branch on directly (-O1)."""
+        return (self.context.optimize and type(node) is BinaryOp_Node
+                and node.op.type in _conditional_jumps)
+
+    def generate_branch(self, node, label, jump_if, nested=False):
+        """Jump to `label` if the truth of condition `node` is `jump_if`.
+
+        With --short-circuit, && and || jump straight to the targets of
+        their operands instead of producing a value first.  At -O1 a
+        comparison is a cmp and the conditional jump, without the 0 or 1
+        in %rax in between.  Where the function can fall off its end that
+        value may be returned, so the callers put it back on both paths
+        (the peephole optimizer removes it again where it is dead); on
+        the paths out of an && or || that is not possible, and their
+        comparisons are only fused in functions that always return.
+        """
+        if is_logical(node, self.context):
+            if (node.op.type == TokenType.TK_AND) != jump_if:
+                # && jumping when false, || when true: either operand decides
+                yield from self.generate_branch(node.left, label, jump_if, True)
+                yield from self.generate_branch(node.right, label, jump_if, True)
+            else:
+                skip = self.new_label()
+                yield from self.generate_branch(node.left, skip, not jump_if, True)
+                yield from self.generate_branch(node.right, label, jump_if, True)
+                self.emit(Label(skip))
+        elif self.fuses(node) and not (nested and self.falls_off):
+            yield node.right
+            self.emit(self._push_rax)
+            yield node.left
+            self.emit(self._pop_rdi)
+            self.emit(self._cmp_rdi_rax)
+            when_true, when_false = _conditional_jumps[node.op.type]
+            self.emit(Instruction(when_true if jump_if else when_false, label))
+        else:
+            yield node
+            self.emit(self._cmp_0_rax)
+            self.emit(Instruction('jne' if jump_if else 'je', label))
+
+    def restore_condition(self, node, instruction):
+        """After a fused `node`, set %rax to its value if it could be returned."""
+        if self.falls_off and self.fuses(node):
+            self.emit(instruction)
+
+    def reduce_strength(self, node):
+        """-O1: the operand to compute and the code for `node`, a * or / by a constant."""
+        left = constant_value(node.left)
+        right = constant_value(node.right)
+        code = None
+        if node.op.type == TokenType.TK_MUL:
+            if right is not None:
+                operand, code = node.left, multiplication(right, '%rax', '%rdi')
+            elif left is not None:
+                operand, code = node.right, multiplication(left, '%rax', '%rdi')
+        elif node.op.type == TokenType.TK_DIV and right is not None:
+            operand, code = node.left, division(right, '%rdi')
+        if code is None:
+            return None
+        self.reduced += 1
+        return operand, code
 
     def visit_BinaryOp_Node(self, node):
-        node.right.accept(self)
-        print(f"    push %rax")
-        node.left.accept(self)
-        print(f"    pop %rdi")
+        if is_logical(node, self.context):
+            false = self.new_label()
+            end = self.new_label()
+            yield from self.generate_branch(node, false, False)
+            self.emit(self._mov_1_rax)
+            self.emit(Instruction('jmp', end))
+            self.emit(Label(false))
+            self.emit(self._mov_0_rax)
+            self.emit(Label(end))
+            return
+        if self.context.optimize:
+            reduced = self.reduce_strength(node)
+            if reduced is not None:
+                operand, code = reduced
+                yield operand
+                for instruction in code:
+                    self.emit(instruction)
+                return
+        yield node.right
+        self.emit(self._push_rax)
+        yield node.left
+        self.emit(self._pop_rdi)
         if node.op.type == TokenType.TK_PLUS:
-            print(f"    add %rdi, %rax")
+            self.emit(self._add_rdi_rax)
         elif node.op.type == TokenType.TK_MINUS:
-            print(f"    sub %rdi, %rax")
+            self.emit(self._sub_rdi_rax)
         elif node.op.type == TokenType.TK_MUL:
-            print(f"    imul %rdi, %rax")
+            self.emit(self._imul_rdi_rax)
         elif node.op.type == TokenType.TK_DIV:
-            print(f"    cqo")
-            print(f"    idiv %rdi")
+            self.emit(self._cqo)
+            self.emit(self._idiv_rdi)
         elif node.op.type == TokenType.TK_EQ:
-            print(f"    cmp %rdi, %rax")
-            print(f"    sete %al")
-            print(f"    movzb %al, %rax")
+            self.emit(self._cmp_rdi_rax)
+            self.emit(self._sete_al)
+            self.emit(self._movzb_al_rax)
         elif node.op.type == TokenType.TK_NE:
-            print(f"    cmp %rdi, %rax")
-            print(f"    setne %al")
-            print(f"    movzb %al, %rax")
+            self.emit(self._cmp_rdi_rax)
+            self.emit(self._setne_al)
+            self.emit(self._movzb_al_rax)
         elif node.op.type == TokenType.TK_LT:
-            print(f"    cmp %rdi, %rax")
-            print(f"    setl %al")
-            print(f"    movzb %al, %rax")
+            self.emit(self._cmp_rdi_rax)
+            self.emit(self._setl_al)
+            self.emit(self._movzb_al_rax)
         elif node.op.type == TokenType.TK_GT:
-            print(f"    cmp %rdi, %rax")
-            print(f"    setg %al")
-            print(f"    movzb %al, %rax")
+            self.emit(self._cmp_rdi_rax)
+            self.emit(self._setg_al)
+            self.emit(self._movzb_al_rax)
         elif node.op.type == TokenType.TK_LE:
-            print(f"    cmp %rdi, %rax")
-            print(f"    setle %al")
-            print(f"    movzb %al, %rax")
+            self.emit(self._cmp_rdi_rax)
+            self.emit(self._setle_al)
+            self.emit(self._movzb_al_rax)
         elif node.op.type == TokenType.TK_GE:
-            print(f"    cmp %rdi, %rax")
-            print(f"    setge %al")
-            print(f"    movzb %al, %rax")
+            self.emit(self._cmp_rdi_rax)
+            self.emit(self._setge_al)
+            self.emit(self._movzb_al_rax)
         elif node.op.type == TokenType.TK_AND:
-            print(f"    and %rdi, %rax")
+            self.emit(self._and_rdi_rax)
         elif node.op.type == TokenType.TK_OR:
-            print(f"    or %rdi, %rax")
+            self.emit(self._or_rdi_rax)
+
+    def array_item_operand(self, node, register):
+        """-O1: the memory operand of array item `node`, a variable index in `register`.
+
+        None for a constant index too far for a 32-bit displacement.
+        """
+        if node.index.token.type == TokenType.TK_INTEGER_CONST:
+            displacement = node.symbol.offset + (node.index.value - 1) * 8
+            return f'{displacement}(%rbp)' if _is_imm32(f'${displacement}') else None
+        # items count from 1, so x[i] is at offset - 8 + i * 8
+        return f'{node.symbol.offset - 8}(%rbp,{register},8)'
 
     # Compute the absolute address of a given array item.
     # Put it in register %rax
@@ -1187,113 +2500,175 @@ class Codegenerator(NodeVisitor):
         array_offset = node.symbol.offset
         if node.index.token.type == TokenType.TK_INTEGER_CONST:
             array_item_offset = (node.index.value - 1) * 8
-            print(f"    mov ${array_item_offset}, %rax")
-            print(f"    push %rax")
-            print(f"    lea {array_offset}(%rbp), %rax")
-            print(f"    pop %rdi")
-            print(f"    add %rdi, %rax")
+            self.emit(Instruction('mov', f'${array_item_offset}', '%rax'))
+            self.emit(self._push_rax)
+            self.emit(Instruction('lea', f'{array_offset}(%rbp)', '%rax'))
+            self.emit(self._pop_rdi)
+            self.emit(self._add_rdi_rax)
         else:
-            node.index.accept(self)
-            print(f"    sub $1, %rax")
-            print(f"    imul $8, %rax")
-            # print(f"    mov ${array_item_offset}, %rax")
-            print(f"    push %rax")
-            print(f"    lea {array_offset}(%rbp), %rax")
-            print(f"    pop %rdi")
-            print(f"    add %rdi, %rax")
+            yield node.index
+            self.emit(self._sub_1_rax)
+            self.emit(self._imul_8_rax)
+            # self.emit(f"    mov ${array_item_offset}, %rax")
+            self.emit(self._push_rax)
+            self.emit(Instruction('lea', f'{array_offset}(%rbp)', '%rax'))
+            self.emit(self._pop_rdi)
+            self.emit(self._add_rdi_rax)
 
     def visit_Assign_Node(self, node):
         # # generate memory address for left-hand side
         # self.generate_address(node.left)
         if node.left.token.type == TokenType.TK_IDENT:
+            if (self.context.optimize and node.left.array is not None
+                    and self.array_item_operand(node.left, '%rdi') is not None):
+                yield from self.generate_array_item_store(node)
+                return
             # var is left-value
             var_offset = node.left.symbol.offset
-            print(f"    lea {var_offset}(%rbp), %rax")
+            self.emit(Instruction('lea', f'{var_offset}(%rbp)', '%rax'))
             # left-value
-            print(f"    push %rax")
+            self.emit(self._push_rax)
             if node.left.array != None:
                 # array_item is left-value
                 # generate its address in memory (the result is in %rax)
-                self.generate_array_item_address(node.left)
+                yield from self.generate_array_item_address(node.left)
                 # put the address on top of stack
-                print(f"    push %rax")
+                self.emit(self._push_rax)
 
-            node.right.accept(self)
-            print(f"    pop %rdi")
-            print(f"    mov %rax, (%rdi)")
+            yield node.right
+            self.emit(self._pop_rdi)
+            self.emit(self._mov_rax_at_rdi)
+        else:
+            raise SemanticError("not an lvalue", token=node.token)
+
+    def generate_array_item_store(self, node):
+        # -O1: the value goes straight to the item's operand, the index
+        # kept on the stack while the right-hand side is evaluated
+        item = node.left
+        if item.index.token.type != TokenType.TK_INTEGER_CONST:
+            yield item.index
+            self.emit(self._push_rax)
+            yield node.right
+            self.emit(self._pop_rdi)
         else:
-            error("not an lvalue");
+            yield node.right
+        self.emit(Instruction('mov', '%rax', self.array_item_operand(item, '%rdi')))
 
     def visit_Num_Node(self, node):
         if node.value == 'true': # like c, 1 stands for true
-            print(f"    mov $1, %rax")
+            self.emit(self._mov_1_rax)
         elif node.value == 'false': # like c, 0 stands for false
-            print(f"    mov $0, %rax")
+            self.emit(self._mov_0_rax)
         else:
-            print(f"    mov ${node.value}, %rax")
+            self.emit(Instruction('mov', f'${node.value}', '%rax'))
 
     def visit_If_Node(self, node):
-        Count.i += 1
-        localLabel = Count.i
-        node.condition.accept(self)
-        print(f"    cmp $0, %rax")
-        print(f"    je  .L.else.{localLabel}")
+        localLabel = self.context.label_count + node.label
+        yield from self.generate_branch(node.condition, f'.L.else.{localLabel}', False)
+        self.restore_condition(node.condition, self._mov_1_rax)
         if node.then_statement is not None:
-            node.then_statement.accept(self)
-        print(f"    jmp .L.endd.{localLabel}")
-        print(f".L.else.{localLabel}:")
+            yield node.then_statement
+        self.emit(Instruction('jmp', f'.L.endd.{localLabel}'))
+        self.emit(Label(f'.L.else.{localLabel}'))
+        self.restore_condition(node.condition, self._mov_0_rax)
         if node.else_statement is not None:
-            node.else_statement.accept(self)
-        print(f".L.endd.{localLabel}:")
+            yield node.else_statement
+        self.emit(Label(f'.L.endd.{localLabel}'))
 
     def visit_While_Node(self, node):
-        Count.i += 1
-        localLabel = Count.i
-        print(f".L.condition.{localLabel}:")
-        node.condition.accept(self)
-        print(f"    cmp $0, %rax")
-        print(f"    je  .L.end.{localLabel}")
+        localLabel = self.context.label_count + node.label
+        if self.context.optimize:
+            yield from self.generate_rotated_loop(node, localLabel)
+            return
+        self.emit(Label(f'.L.condition.{localLabel}'))
+        yield from self.generate_branch(node.condition, f'.L.end.{localLabel}', False)
         if node.statement is not None:
-            node.statement.accept(self)
-        print(f"    jmp .L.condition.{localLabel}")
-        print(f".L.end.{localLabel}:")
+            yield node.statement
+        self.emit(Instruction('jmp', f'.L.condition.{localLabel}'))
+        self.emit(Label(f'.L.end.{localLabel}'))
+
+    def generate_rotated_loop(self, node, localLabel):
+        # -O1: the condition is tested at the bottom, so an iteration
+        # takes one conditional jump instead of a jump and a test
+        self.emit(Instruction('jmp', f'.L.condition.{localLabel}'))
+        self.emit(Label(f'.L.body.{localLabel}'))
+        self.restore_condition(node.condition, self._mov_1_rax)
+        if node.statement is not None:
+            yield node.statement
+        self.emit(Label(f'.L.condition.{localLabel}'))
+        yield from self.generate_branch(node.condition, f'.L.body.{localLabel}', True)
+        self.emit(Label(f'.L.end.{localLabel}'))
+        self.restore_condition(node.condition, self._mov_0_rax)
 
     def visit_Block_Node(self, node):
         for eachnode in node.statement_nodes:
-            eachnode.accept(self)
+            yield eachnode
         # self.log(f'LEAVE scope: {block_name}')
 
 
     def visit_Var_array_item_Node(self, node):
+        operand = self.array_item_operand(node, '%rax') if self.context.optimize else None
+        if operand is not None:
+            if node.index.token.type != TokenType.TK_INTEGER_CONST:
+                yield node.index
+            self.emit(Instruction('mov', operand, '%rax'))
+            return
         # array_item is right-value
         # generate its address in memory (the result is in %rax)
-        self.generate_array_item_address(node)
+        yield from self.generate_array_item_address(node)
         # put the value in memory (location is (%rax)) into %rax
-        print(f"    mov (%rax), %rax")
+        self.emit(self._mov_at_rax_rax)
 
 
     def visit_Var_Node(self, node):
         # var is right-value
         var_offset = node.symbol.offset
-        print(f"    lea {var_offset}(%rbp), %rax")
+        self.emit(Instruction('lea', f'{var_offset}(%rbp)', '%rax'))
         # right-value
-        print(f"    mov (%rax), %rax")
+        self.emit(self._mov_at_rax_rax)
 
     def visit_VarDecl_Node(self, node):
         if node.var_node.array != None:
             array_offset = node.var_node.symbol.offset
             array_size = node.var_node.array['size']
+            items = node.var_node.array['items']
+            if self.context.optimize and array_size >= BULK_INITIALIZATION:
+                copied = initialized_items(array_size, items)
+                if copied:
+                    self.data.append((f'.{self.function_name}.data.{len(self.data) + 1}',
+                                      items[:copied]))
+                    self.copy_data(array_offset, self.data[-1][0], copied)
+                if copied < array_size:
+                    self.zero_fill(array_offset + copied * 8, array_size - copied)
+                # as the item stores leave it
+                self.emit(Instruction('lea', f'{array_offset + (array_size - 1) * 8}(%rbp)',
+                                      '%rax'))
+                return
+            if self.context.optimize:
+                for i in range(array_size):
+                    # the items not given are 0
+                    item_value = items[i] if i < len(items) else 0
+                    operand = f'{array_offset + i * 8}(%rbp)'
+                    if _is_imm32(f'${item_value}'):
+                        self.emit(Instruction('movq', f'${item_value}', operand))
+                    else:
+                        self.emit(Instruction('mov', f'${item_value}', '%rdi'))
+                        self.emit(Instruction('mov', '%rdi', operand))
+                self.emit(Instruction('lea', f'{array_offset + (array_size - 1) * 8}(%rbp)',
+                                      '%rax'))
+                return
             i = 0
             while i < array_size:
                 array_item_offset = i * 8
-                print(f"    mov ${array_item_offset}, %rax")
-                print(f"    push %rax")
-                print(f"    lea {array_offset}(%rbp), %rax")
-                print(f"    pop %rdi")
-                print(f"    add %rdi, %rax")
-                item_value = node.var_node.array['items'][i]
-                print(f"    mov ${item_value}, %rdi")
-                print(f"    mov %rdi, (%rax)")
+                self.emit(Instruction('mov', f'${array_item_offset}', '%rax'))
+                self.emit(self._push_rax)
+                self.emit(Instruction('lea', f'{array_offset}(%rbp)', '%rax'))
+                self.emit(self._pop_rdi)
+                self.emit(self._add_rdi_rax)
+                # the items not given are 0
+                item_value = items[i] if i < len(items) else 0
+                self.emit(Instruction('mov', f'${item_value}', '%rdi'))
+                self.emit(self._mov_rdi_at_rax)
                 i += 1
 
     def visit_FormalParam_Node(self, node):
@@ -1302,93 +2677,2189 @@ class Codegenerator(NodeVisitor):
     def visit_FunctionCall_Node(self, node):
         nparams = 0
         for eachnode in node.actual_parameter_nodes:
-            eachnode.accept(self)
-            print(f"    push %rax")
+            yield eachnode
+            self.emit(self._push_rax)
             nparams += 1
         for i in range(nparams, 0, -1):
-            print(f"    pop %{parameter_registers[i-1]}")
+            self.emit(Instruction('pop', f'%{parameter_registers[i-1]}'))
 
-        print(f"    mov $0, %rax")
-        print(f"    call {node.function_name}")
+        self.emit(self._mov_0_rax)
+        self.emit(Instruction('call', node.function_name))
 
     def visit_FunctionDef_Node(self, node):
-        # initialize the offset for each function
-        Offset.sum = 0
-        print(f"    .text")
-        print(f"    .global {node.function_name}")
-        print(f"{node.function_name}:")
+        start = len(self.emitter.lines) if self.context.optimize else None
+        self.function_name = node.function_name
+        self.local_labels = 0
+        # the multiplications and divisions strength-reduced
+        self.reduced = 0
+        # the (label, items) of the .rodata arrays its initializations copy
+        self.data = []
+        # whether it can return the value of the last expression evaluated
+        statements = node.block_node.statement_nodes
+        self.falls_off = not statements or type(statements[-1]) is not Return_Node
+        self.emit(self._text)
+        self.emit(Instruction('.global', node.function_name))
+        self.emit(Label(node.function_name))
         # Prologue
-        print(f"    push %rbp")
-        print(f"    mov %rsp, %rbp")
+        self.emit(self._push_rbp)
+        self.emit(self._mov_rsp_rbp)
         stack_size = self.align_to(node.offset, 16)
-        print(f"    sub ${stack_size}, %rsp")
+        self.emit(Instruction('sub', f'${stack_size}', '%rsp'))
 
         i = 0
         for eachparam in node.formal_parameters:
             parameter_offset = eachparam.parameter_symbol.offset
-            print(f"    mov %{parameter_registers[i]}, {parameter_offset}(%rbp)")
+            self.emit(Instruction('mov', f'%{parameter_registers[i]}', f'{parameter_offset}(%rbp)'))
             i += 1
 
         # Visit function block
-        node.block_node.accept(self)
+        yield node.block_node
+        self.context.label_count += node.labels
 
-        print(f".{node.function_name}.return:")
+        self.emit(Label(f'.{node.function_name}.return'))
         # Epilogue
-        print(f"    mov %rbp, %rsp")
-        print(f"    pop %rbp")
-        print(f"    ret")
+        self.emit(self._mov_rbp_rsp)
+        self.emit(self._pop_rbp)
+        self.emit(self._ret)
+        if start is not None:
+            self.report_strength_reduction(node.function_name)
+            code = self.emitter.lines
+            code[start:] = PeepholeOptimizer(self.context).optimize(code[start:], node.function_name)
+        self.emit_data(self.data)
+        self.emitter.flush()
+
+    def report_strength_reduction(self, function_name):
+        if self.context.opt_report and self.reduced:
+            print(f"{function_name}: strength reduction replaced {self.reduced} "
+                  f"multiplications and divisions by constants", file=sys.stderr)
 
 
     def code_generate(self, tree):
+        if self.context.codegen_jobs > 1:
+            self.code_generate_parallel(tree, self.context.codegen_jobs)
+            return
         # Traverse the AST to emit assembly.
         for node in tree:
             if node is not None:
-                node.accept(self)
+                self.visit(node)
+        self.emitter.flush()
+
+    def code_generate_parallel(self, tree, jobs):
+        """Generate the functions of `tree` on `jobs` forked processes.
+
+        Each function numbers its labels from the sum of the labels of the
+        functions before it (FunctionDef_Node.labels, counted by the
+        SemanticAnalyzer), so the chunks can be generated independently
+        and concatenated in source order, exactly as code_generate() would
+        have emitted them.
+        """
+        functions = [node for node in tree if node is not None]
+        chunksize = max(1, len(functions) // (jobs * 4))
+        chunks = []
+        label_base = self.context.label_count
+        for start in range(0, len(functions), chunksize):
+            stop = min(start + chunksize, len(functions))
+            chunks.append((start, stop, label_base))
+            label_base += sum(node.labels for node in functions[start:stop])
+        # forked workers inherit the tree instead of having it pickled
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs, mp_context=multiprocessing.get_context('fork'),
+                initializer=_init_codegen_worker, initargs=(functions, self.context)) as executor:
+            for assembly in executor.map(_generate_functions, *zip(*chunks)):
+                self.emit(assembly[:-1])
+                self.emitter.flush()
+        self.context.label_count = label_base
+
+
+# the analyzed functions and the context of a code_generate_parallel() worker process
+_codegen_functions = None
+_codegen_context = None
+
+def _init_codegen_worker(functions, context):
+    global _codegen_functions, _codegen_context
+    _codegen_functions = functions
+    _codegen_context = context
+
+def _generate_functions(start, stop, label_base):
+    options = _codegen_context
+    context = CompileContext(optimize=options.optimize, opt_report=options.opt_report,
+                             backend=options.backend, short_circuit=options.short_circuit,
+                             emit_ir=options.emit_ir, verify_ir=options.verify_ir)
+    context.label_count = label_base
+    emitter = Emitter()
+    codegenerator = BACKENDS[context.backend](emitter, context)
+    for node in _codegen_functions[start:stop]:
+        codegenerator.visit(node)
+    return emitter.getvalue()
 
 
 
 ##################################################################################################
 #
-#  DRIVER
+#  STRENGTH-REDUCTION
 #
 ##################################################################################################
 
-def main():
-    parser = argparse.ArgumentParser(
-        description='cbypython - Simple C-like Compiler'
-    )
-    parser.add_argument('inputfile', help='C-like source file')
-    args = parser.parse_args()
+# At -O1 both code generators multiply and divide by a constant with
+# the instructions below instead of imul, 3 cycles of latency, and a
+# 64-bit idiv, tens of them.
+
+def _power_of_two(n):
+    """k if `n` is 2**k, else None."""
+    return n.bit_length() - 1 if n > 0 and n & (n - 1) == 0 else None
+
+# the factors a lea computes, with their scale
+_lea_scales = {9: 8, 5: 4, 3: 2}
+
+def multiplication(factor, register, scratch):
+    """The instructions multiplying `register` by the constant `factor`.
+
+    A power of two is a shift, 3, 5 and 9 are a lea, and so on for their
+    products and 2**k + 1 and 2**k - 1; `scratch` is overwritten for the
+    last two.  None where that takes more than two instructions waiting
+    for each other, as imul is as fast then.
+    """
+    magnitude = abs(factor)
+    if magnitude == 0:
+        return [Instruction('mov', '$0', register)]
+    shift = _power_of_two(magnitude & -magnitude)
+    odd = magnitude >> shift
+    code = []
+    if odd in (1, 3, 5, 9, 15, 25, 27, 45, 81):
+        for each, scale in _lea_scales.items():
+            while odd % each == 0:
+                code.append(Instruction('lea', f'({register},{register},{scale})', register))
+                odd //= each
+    elif shift == 0 and _power_of_two(odd - 1) is not None:
+        code += [Instruction('mov', register, scratch),
+                 Instruction('shl', f'${_power_of_two(odd - 1)}', register),
+                 Instruction('add', scratch, register)]
+    elif shift == 0 and _power_of_two(odd + 1) is not None:
+        code += [Instruction('mov', register, scratch),
+                 Instruction('shl', f'${_power_of_two(odd + 1)}', register),
+                 Instruction('sub', scratch, register)]
+    else:
+        return None
+    if shift > 0:
+        code.append(Instruction('shl', f'${shift}', register))
+    if factor < 0:
+        code.append(Instruction('neg', register))
+    if sum(instruction.op != 'mov' for instruction in code) > 2:
+        return None
+    return code
+
+def _magic(divisor):
+    """The (multiplier, shift) of a division by `divisor`, 3 <= divisor < 2**63.
+
+    With them n / divisor is the high 64 bits of n * multiplier shifted
+    right by shift, plus 1 for a negative n: Hacker's Delight, section
+    10-4.  The smallest shift that is exact for every 64-bit n is taken.
+    """
+    # the largest n < 2**63 leaving the remainder divisor - 1
+    largest = 2**63 - 2**63 % divisor - 1
+    p = 64
+    while 2**p <= largest * (divisor - 2**p % divisor):
+        p += 1
+    return (2**p + divisor - 2**p % divisor) // divisor, p - 64
+
+def division(divisor, scratch):
+    """The instructions dividing %rax by the constant `divisor`, as idiv would.
+
+    The quotient is truncated toward zero and left in %rax; %rdx and
+    `scratch` are overwritten.  None for 0 and -1, whose idiv can trap.
+    """
+    if divisor in (0, -1):
+        return None
+    magnitude = abs(divisor)
+    shift = _power_of_two(magnitude)
+    code = []
+    if shift is not None:
+        if shift > 0:
+            # a negative dividend is rounded up: 2**shift - 1 added first
+            code.append(Instruction('mov', '%rax', scratch))
+            if shift > 1:
+                code.append(Instruction('sar', '$63', scratch))
+            code += [Instruction('shr', f'${64 - shift}', scratch),
+                     Instruction('add', scratch, '%rax'),
+                     Instruction('sar', f'${shift}', '%rax')]
+    else:
+        multiplier, shift = _magic(magnitude)
+        code += [Instruction('mov', '%rax', scratch),
+                 Instruction('mov', f'${_wrap(multiplier)}', '%rdx'),
+                 Instruction('imul', '%rdx')]
+        if multiplier >= 2**63:
+            # it was multiplied by multiplier - 2**64
+            code.append(Instruction('add', scratch, '%rdx'))
+        if shift > 0:
+            code.append(Instruction('sar', f'${shift}', '%rdx'))
+        code += [Instruction('sar', '$63', scratch),
+                 Instruction('sub', scratch, '%rdx'),
+                 Instruction('mov', '%rdx', '%rax')]
+    if divisor < 0:
+        code.append(Instruction('neg', '%rax'))
+    return code
+
+
+##################################################################################################
+#
+#  PEEPHOLE-OPTIMIZER
+#
+##################################################################################################
 
-    Inputfile.name = args.inputfile
-    if Inputfile.name == '-':
-        Inputfile.buffer = sys.stdin.readlines()
+_register_names = re.compile(r'%(\w+)')
+# the part registers the code generator uses, by their full register
+_full_registers = {'al': 'rax'}
+
+def _registers(operand):
+    return frozenset(_full_registers.get(name, name) for name in _register_names.findall(operand))
+
+# effects() of every instruction seen so far, by (op, operands)
+_effects = {}
+
+def effects(instruction):
+    """Return the (read, written) register sets of `instruction`.
+
+    None for labels, jumps, calls, returns and directives: the places
+    where the rewrites below stop looking.
+    """
+    if type(instruction) is not Instruction:
+        return None
+    key = (instruction.op, instruction.operands)
+    result = _effects.get(key)
+    if result is not None or key in _effects:
+        return result
+    op, operands = key
+    if op[0] in '.j' or op in ('call', 'ret'):
+        result = None
+    elif op == 'push':
+        result = (_registers(operands[0]) | {'rsp'}, frozenset({'rsp'}))
+    elif op == 'pop':
+        result = (frozenset({'rsp'}), _registers(operands[0]) | {'rsp'})
+    elif op == 'cqo':
+        result = (frozenset({'rax'}), frozenset({'rdx'}))
+    elif op == 'rep':
+        # rep movsq copies %rcx quadwords from (%rsi) to (%rdi), rep stosq stores %rax
+        result = (frozenset({'rax', 'rcx', 'rsi', 'rdi'}), frozenset({'rcx', 'rsi', 'rdi'}))
+    elif op == 'idiv' or op == 'imul' and len(operands) == 1:
+        # imul %rdx: %rdx:%rax = %rax * %rdx
+        result = (_registers(operands[0]) | {'rax', 'rdx'}, frozenset({'rax', 'rdx'}))
+    elif len(operands) == 1:
+        # neg, not, set<cc>
+        result = (_registers(operands[0]), _registers(operands[0]))
     else:
-        Inputfile.buffer = open(args.inputfile, 'r').readlines()
+        source, destination = operands
+        if '(' in destination or op == 'cmp':
+            result = (_registers(source) | _registers(destination), frozenset())
+        elif op in ('mov', 'lea', 'movzb'):
+            result = (_registers(source), _registers(destination))
+        else:
+            result = (_registers(source) | _registers(destination), _registers(destination))
+    _effects[key] = result
+    return result
+
+
+def is_dead(code, start, register):
+    """Whether `register` is written before it is read, from code[start] on."""
+    for i in range(start, len(code)):
+        instruction = code[i]
+        if type(instruction) is Label:
+            # reached from elsewhere too, but that does not make our value live
+            continue
+        instruction_effects = effects(instruction)
+        if instruction_effects is None:
+            return False
+        reads, writes = instruction_effects
+        if register in reads:
+            return False
+        if register in writes:
+            return True
+    return False
+
+
+class PeepholeOptimizer:
+    """Removes redundant instructions from the code of one function (-O1).
+
+    The stack-machine code keeps every intermediate value in %rax and
+    passes it on through push and pop.  The rewrites below are applied
+    until none applies any more:
+
+      push %rax ... pop %rdi        ->  mov %rax, %rdi ...
+      lea -8(%rbp), %rax
+      mov (%rax), %rax              ->  mov -8(%rbp), %rax
+      lea -8(%rbp), %rdi ...
+      mov %rax, (%rdi)              ->  ... mov %rax, -8(%rbp)
+      mov $1, %rax
+      mov %rax, %rdi                ->  mov $1, %rdi
+      mov %rax, -8(%rbp)
+      mov -8(%rbp), %rax            ->  mov %rax, -8(%rbp)
+      jmp .L.x
+      .L.x:                         ->  .L.x:
+
+    and moves into a register that is written before it is read again
+    are dropped.  None of them crosses a label or a jump, and a register
+    only counts as dead once it has certainly been overwritten.
+
+    Last, a leaf function loses its frame (elide_frame()).
+    """
+    def __init__(self, context=None):
+        self.context = CompileContext() if context is None else context
+
+    def optimize(self, code, function_name):
+        """Return `code`, the instructions of function `function_name`, optimized."""
+        code = list(code)
+        before = sum(type(instruction) is Instruction for instruction in code)
+        changed = True
+        while changed:
+            changed = False
+            i = 0
+            while i < len(code):
+                if self.rewrite(code, i):
+                    changed = True
+                else:
+                    i += 1
+        self.elide_frame(code, function_name)
+        if self.context.opt_report:
+            after = sum(type(instruction) is Instruction for instruction in code)
+            print(f"{function_name}: peephole removed {before - after} of {before} instructions",
+                  file=sys.stderr)
+        return code
+
+    def elide_frame(self, code, function_name):
+        """Keep the frame of a leaf function in the red zone, without %rbp.
+
+        A function that calls nothing, never pushes and never moves %rsp
+        may use the 128 bytes below %rsp (the SysV red zone) without
+        reserving them.  Then it needs no frame pointer either: its slots
+        n(%rbp) become n(%rsp), the prologue and epilogue go, and a jump
+        to what is left of the epilogue, if only the ret, is a ret.
+        Stack machine code that still pushes intermediate values after
+        the rewrites above keeps its frame.
+        """
+        start = next((i for i, instruction in enumerate(code)
+                      if type(instruction) is Instruction and instruction.op == 'push'), None)
+        if (start is None or list(map(str, code[start:start + 2])) != self._prologue
+                or list(map(str, code[-3:])) != self._epilogue):
+            return
+        reserve = code[start + 2]
+        if (type(reserve) is not Instruction or reserve.op != 'sub'
+                or reserve.operands[1] != '%rsp' or int(reserve.operands[0][1:]) > 128):
+            return
+        body = code[start + 3:-3]
+        for instruction in body:
+            if type(instruction) is not Instruction:
+                continue
+            if instruction.op in ('call', 'push', 'pop') or any(
+                    '%rsp' in operand or '%rbp' in operand and '(%rbp' not in operand
+                    for operand in instruction.operands):
+                return
+        # the epilogue is just a ret now, unless it restores registers
+        epilogue = f'.{function_name}.return'
+        if type(body[-1]) is not Label or body[-1].name != epilogue:
+            epilogue = None
+        for i, instruction in enumerate(body):
+            if type(instruction) is not Instruction:
+                continue
+            if instruction.op == 'jmp' and instruction.operands == (epilogue,):
+                body[i] = self._ret
+            elif any('(%rbp' in operand for operand in instruction.operands):
+                body[i] = Instruction(instruction.op, *(operand.replace('(%rbp', '(%rsp')
+                                                         for operand in instruction.operands))
+        if self.context.opt_report:
+            print(f"{function_name}: leaf function, its {reserve.operands[0][1:]} byte frame "
+                  f"kept in the red zone", file=sys.stderr)
+        code[start:] = body + [self._ret]
+
+    _prologue = ['    push %rbp', '    mov %rsp, %rbp']
+    _epilogue = ['    mov %rbp, %rsp', '    pop %rbp', '    ret']
+    _ret = Instruction('ret')
+
+    def rewrite(self, code, i):
+        """Apply one rewrite at code[i], if any applies; return whether one did."""
+        instruction = code[i]
+        if type(instruction) is not Instruction:
+            return False
+        op = instruction.op
+        operands = instruction.operands
+        next = code[i + 1] if i + 1 < len(code) else None
+        if op == 'jmp':
+            if type(next) is Label and next.name == operands[0]:
+                del code[i]
+                return True
+            return False
+        if op == 'pop':
+            return self.forward_push(code, i)
+        if len(operands) == 2 and any(operand[:2] == '(%' for operand in operands):
+            if self.fold_address(code, i):
+                return True
+        if op not in ('mov', 'lea', 'movzb') or len(operands) != 2:
+            return False
+        source, destination = operands
+        if destination[0] == '%':
+            register = destination[1:]
+            if source == destination or (register not in ('rsp', 'rbp')
+                                         and is_dead(code, i + 1, register)):
+                del code[i]
+                return True
+            if (op != 'movzb' and type(next) is Instruction and next.op == 'mov'
+                    and next.operands[0] == destination and next.operands[1][0] == '%'
+                    and is_dead(code, i + 2, register)):
+                code[i] = Instruction(op, source, next.operands[1])
+                del code[i + 1]
+                return True
+        elif (op == 'mov' and source[0] == '%' and type(next) is Instruction
+              and next.op == 'mov' and next.operands == (destination, source)):
+            # a value stored and loaded straight back
+            del code[i + 1]
+            return True
+        return False
+
+    def forward_push(self, code, i):
+        # pop %rdi: find its push, with nothing in between that uses %rdi or the stack
+        destination = code[i].operands[0]
+        register = destination[1:]
+        for k in range(i - 1, -1, -1):
+            instruction = code[k]
+            if type(instruction) is Instruction and instruction.op == 'push':
+                source = instruction.operands[0]
+                if source == destination:
+                    del code[i]
+                    del code[k]
+                else:
+                    code[k] = Instruction('mov', source, destination)
+                    del code[i]
+                return True
+            instruction_effects = effects(instruction)
+            if instruction_effects is None:
+                return False
+            reads, writes = instruction_effects
+            if 'rsp' in reads or 'rsp' in writes or register in reads or register in writes:
+                return False
+        return False
+
+    def fold_address(self, code, i):
+        # an operand (%reg) whose address was just computed by lea
+        instruction = code[i]
+        operands = instruction.operands
+        at = 0 if operands[0][:2] == '(%' else 1
+        register = operands[at][2:-1]
+        other = operands[1 - at]
+        if ',' in register:
+            # (%rax,%rax,2): a multiplication, not an address
+            return False
+        # the other operand may only overwrite the register, not need its value
+        if register in ('rsp', 'rbp') or (register in _registers(other)
+                                          and (at == 1 or '(' in other)):
+            return False
+        written = set()
+        for k in range(i - 1, -1, -1):
+            instruction_effects = effects(code[k])
+            if instruction_effects is None:
+                return False
+            reads, writes = instruction_effects
+            if register in writes:
+                definition = code[k]
+                if (definition.op != 'lea' or definition.operands[1] != '%' + register
+                        or _registers(definition.operands[0]) & written):
+                    return False
+                break
+            if register in reads:
+                return False
+            written |= writes
+        else:
+            return False
+        if not (register in effects(instruction)[1] or is_dead(code, i + 1, register)):
+            return False
+        operands = list(operands)
+        operands[at] = definition.operands[0]
+        code[i] = Instruction(instruction.op, *operands)
+        del code[k]
+        return True
 
-    # 读入源程序
-    # Inputfile.buffer = open("tmpc", 'r').readlines()
-    Inputfile_plain_text = ''
-    for line in Inputfile.buffer:
-        Inputfile_plain_text += line
 
-    # 词法分析
-    lexer = Lexer(Inputfile_plain_text)
+##################################################################################################
+#
+#  INTERMEDIATE-REPRESENTATION
+#
+##################################################################################################
 
-    # for eachtok in lexer.gather_all_tokens():
-    #     print(eachtok.value)
+class VReg:
+    """A virtual register of the three-address code: a variable or a temporary."""
+    __slots__ = ('number', 'symbol')
+
+    def __init__(self, number, symbol=None):
+        self.number = number
+        # the Var_Symbol or Parameter_Symbol kept in it, None for a temporary
+        self.symbol = symbol
+
+    def __repr__(self):
+        if self.symbol is not None:
+            return f"%{self.symbol.name}.{self.number}"
+        return f"%{self.number}"
+
+
+class IROp:
+    """One instruction of the three-address code: dst = opcode(args).
+
+    The operands are VRegs or int constants; the other args are frame
+    offsets, labels and function names:
+
+        entry                   defines its args, the parameters
+        copy neg not            dst = op a
+        add sub mul div and or eq ne lt gt le ge
+                                dst = a op b
+        load                    dst = array[index]      args: offset, index
+        store                   array[index] = a        args: offset, index, a
+        addr                    dst = &array[index]     args: offset, constant index
+        call                    dst = name(args...)     args: name, arguments...
+        copy_data               array = .rodata label   args: offset, label, count
+        zero                    array[...] = 0          args: offset, count
+        label, jump             args: label
+        branch_zero             if a == 0 goto label    args: a, label
+        branch_nonzero          if a != 0 goto label    args: a, label
+        ret                     return a
+
+    "label" only occurs in the flat code Lowering produces; in the
+    blocks of an IRFunction it is BasicBlock.label.
+    """
+    __slots__ = ('opcode', 'dst', 'args')
+
+    def __init__(self, opcode, dst, *args):
+        self.opcode = opcode
+        self.dst = dst
+        self.args = args
+
+    def uses(self):
+        if self.opcode == 'entry':
+            return []
+        return [arg for arg in self.args if type(arg) is VReg]
+
+    def defs(self):
+        if self.opcode == 'entry':
+            return list(self.args)
+        return [] if self.dst is None else [self.dst]
+
+    def __repr__(self):
+        args = ', '.join(map(str, self.args))
+        if self.dst is None:
+            return f"{self.opcode} {args}".rstrip()
+        return f"{self.dst} = {self.opcode} {args}"
+
+
+# opcodes without any effect but defining dst; "div" can trap, so it is not one
+_pure_opcodes = frozenset(('copy', 'neg', 'not', 'add', 'sub', 'mul', 'and', 'or',
+                           'eq', 'ne', 'lt', 'gt', 'le', 'ge', 'load', 'addr'))
+# opcodes after which control does not go on to the next IROp
+_block_ends = frozenset(('jump', 'branch_zero', 'branch_nonzero', 'ret'))
+# opcodes that overwrite the caller-saved registers
+_clobbering_opcodes = frozenset(('call', 'copy_data', 'zero'))
+# opcode -> number of args (None: any number), whether it has a dst
+_opcode_shapes = {
+    'entry': (None, False), 'copy': (1, True), 'neg': (1, True), 'not': (1, True),
+    'add': (2, True), 'sub': (2, True), 'mul': (2, True), 'div': (2, True),
+    'and': (2, True), 'or': (2, True), 'eq': (2, True), 'ne': (2, True),
+    'lt': (2, True), 'gt': (2, True), 'le': (2, True), 'ge': (2, True),
+    'load': (2, True), 'store': (3, False), 'addr': (2, True), 'call': (None, True),
+    'copy_data': (3, False), 'zero': (2, False),
+    'jump': (1, False), 'branch_zero': (2, False), 'branch_nonzero': (2, False),
+    'ret': (1, False),
+}
+# opcode -> the positions of its args that are labels or function names, not operands
+_opcode_names = {'call': [0], 'jump': [0], 'branch_zero': [1], 'branch_nonzero': [1],
+                 'copy_data': [1]}
+
+_binary_opcodes = {
+    TokenType.TK_PLUS: 'add', TokenType.TK_MINUS: 'sub',
+    TokenType.TK_MUL: 'mul', TokenType.TK_DIV: 'div',
+    TokenType.TK_AND: 'and', TokenType.TK_OR: 'or',
+    TokenType.TK_EQ: 'eq', TokenType.TK_NE: 'ne',
+    TokenType.TK_LT: 'lt', TokenType.TK_GT: 'gt',
+    TokenType.TK_LE: 'le', TokenType.TK_GE: 'ge',
+}
+
+
+class BasicBlock:
+    """A run of IROps entered only at the top and left only at the bottom.
+
+    It ends with a jump, a branch or a ret (its terminator), or else
+    falls through to the next block of the function.
+    """
+    __slots__ = ('label', 'ops', 'successors', 'predecessors')
+
+    def __init__(self, label=None):
+        # the label jumps to it use, None if only fallen into
+        self.label = label
+        self.ops = []
+        self.successors = []
+        self.predecessors = []
+
+    def terminator(self):
+        if self.ops and self.ops[-1].opcode in _block_ends:
+            return self.ops[-1]
+        return None
+
+
+class IRFunction:
+    """The three-address code of one function, as a control-flow graph.
+
+    `blocks` are in code order, the entry block first; every block's
+    successors and predecessors are the edges of the graph, kept up to
+    date by connect() whenever a pass changes the blocks.
+    """
+    __slots__ = ('name', 'blocks', 'frame_size', 'data')
+
+    def __init__(self, name, blocks, frame_size, data=()):
+        self.name = name
+        self.blocks = blocks
+        # bytes of frame the SemanticAnalyzer gave its variables
+        self.frame_size = frame_size
+        # the (label, items) of the .rodata arrays copy_data copies
+        self.data = list(data)
+        self.connect()
+
+    @classmethod
+    def from_code(cls, name, code, frame_size, data=()):
+        """Split flat code, with "label" IROps, into basic blocks."""
+        blocks = [BasicBlock()]
+        for op in code:
+            block = blocks[-1]
+            if op.opcode == 'label':
+                if block.ops or block.label is not None:
+                    blocks.append(BasicBlock(op.args[0]))
+                else:
+                    block.label = op.args[0]
+                continue
+            if block.terminator() is not None:
+                block = BasicBlock()
+                blocks.append(block)
+            block.ops.append(op)
+        return cls(name, blocks, frame_size, data)
+
+    def connect(self):
+        """Recompute the edges from the terminators and the block order."""
+        labels = {block.label: block for block in self.blocks if block.label is not None}
+        for block in self.blocks:
+            block.predecessors = []
+        for i, block in enumerate(self.blocks):
+            following = self.blocks[i + 1:i + 2]
+            last = block.terminator()
+            if last is None:
+                successors = following
+            elif last.opcode == 'jump':
+                successors = [labels[last.args[0]]]
+            elif last.opcode == 'ret':
+                successors = []
+            else:
+                successors = following + [labels[last.args[1]]]
+            block.successors = successors
+            for successor in successors:
+                successor.predecessors.append(block)
+
+    def ops(self):
+        """All IROps, in code order."""
+        for block in self.blocks:
+            yield from block.ops
+
+    def block_name(self, block):
+        return block.label if block.label is not None else f'.b{self.blocks.index(block)}'
+
+    def __str__(self):
+        names = {block: self.block_name(block) for block in self.blocks}
+        lines = [f"{self.name}:    ; frame {self.frame_size}"]
+        for block in self.blocks:
+            predecessors = ' '.join(names[each] for each in block.predecessors) or '-'
+            successors = ' '.join(names[each] for each in block.successors) or '-'
+            lines.append(f"{names[block]}:    ; from {predecessors}; to {successors}")
+            lines.extend(f"    {op!r}" for op in block.ops)
+        for label, items in self.data:
+            lines.append(f"{label}:    ; .rodata")
+            lines.extend(f"    {', '.join(map(str, items[i:i + 16]))}"
+                         for i in range(0, len(items), 16))
+        return '\n'.join(lines)
+
+
+class IRError(Exception):
+    """An IRFunction breaks an invariant: a bug in the pass that built it."""
+
+
+def verify_ir(function, after='lowering'):
+    """Check the invariants of `function`, raise IRError if one is broken.
+
+      * the entry op starts the first block and occurs nowhere else;
+      * every op has the args and dst its opcode needs, its operands
+        being VRegs or ints, and only the last op of a block is a
+        terminator; the last block ends with one;
+      * block labels are unique and every jump or branch goes to one;
+      * successors and predecessors are the edges the terminators and
+        the fall-throughs make, each in both lists;
+      * a temporary is defined on every path to each of its uses
+        (a variable may be read before any assignment, as in C).
+    """
+    def fail(message):
+        raise IRError(f"{function.name}: after {after}: {message}")
+
+    blocks = function.blocks
+    if not blocks or not blocks[0].ops or blocks[0].ops[0].opcode != 'entry':
+        fail("the first block does not start with entry")
+    data = {label for label, _ in function.data}
+    labels = {}
+    for block in blocks:
+        if block.label is not None:
+            if block.label in labels:
+                fail(f"label {block.label} defined twice")
+            labels[block.label] = block
+    for i, block in enumerate(blocks):
+        name = function.block_name(block)
+        for j, op in enumerate(block.ops):
+            shape = _opcode_shapes.get(op.opcode)
+            if shape is None:
+                fail(f"{name}: unknown op {op!r}")
+            count, has_dst = shape
+            if count is not None and len(op.args) != count:
+                fail(f"{name}: {op!r} takes {count} args")
+            if has_dst != (type(op.dst) is VReg):
+                fail(f"{name}: {op!r} {'needs' if has_dst else 'cannot have'} a dst")
+            names = [k for k, arg in enumerate(op.args) if type(arg) not in (VReg, int)]
+            if names != _opcode_names.get(op.opcode, []) or not all(type(op.args[k]) is str
+                                                                    for k in names):
+                fail(f"{name}: {op!r} has a bad operand")
+            if op.opcode == 'entry' and (i or j or any(type(arg) is not VReg for arg in op.args)):
+                fail(f"{name}: entry inside the function, or with a constant parameter")
+            if op.opcode in _block_ends and j != len(block.ops) - 1:
+                fail(f"{name}: {op!r} in the middle of a block")
+            if op.opcode in ('jump', 'branch_zero', 'branch_nonzero') and op.args[-1] not in labels:
+                fail(f"{name}: {op!r} goes to no block")
+            if op.opcode == 'copy_data' and op.args[1] not in data:
+                fail(f"{name}: {op!r} copies no data")
+        following = blocks[i + 1:i + 2]
+        last = block.terminator()
+        if last is None:
+            if not following:
+                fail(f"{name}: the last block falls off the function")
+            expected = following
+        elif last.opcode == 'jump':
+            expected = [labels[last.args[0]]]
+        elif last.opcode == 'ret':
+            expected = []
+        else:
+            expected = following + [labels[last.args[1]]]
+        if block.successors != expected:
+            fail(f"{name}: successors are not the targets of its terminator")
+        for successor in block.successors:
+            if block not in successor.predecessors:
+                fail(f"{name}: missing from the predecessors of its successor")
+        for predecessor in block.predecessors:
+            if block not in predecessor.successors:
+                fail(f"{name}: predecessor does not lead to it")
+
+    # temporaries defined on every path: a forward must-analysis
+    everything = {register for op in function.ops() for register in op.defs()}
+    defined_in = {block: set(everything) for block in blocks}
+    defined_in[blocks[0]] = set()
+    changed = True
+    while changed:
+        changed = False
+        for block in blocks:
+            defined = set(defined_in[block])
+            for op in block.ops:
+                defined.update(op.defs())
+            for successor in block.successors:
+                narrowed = defined_in[successor] & defined
+                if len(narrowed) != len(defined_in[successor]):
+                    defined_in[successor] = narrowed
+                    changed = True
+    for block in blocks:
+        defined = set(defined_in[block])
+        for op in block.ops:
+            for register in op.uses():
+                if register.symbol is None and register not in defined:
+                    fail(f"{function.block_name(block)}: {op!r} uses {register!r}, "
+                         f"not defined on every path to it")
+            defined.update(op.defs())
+
+
+def remove_unreachable_blocks(function):
+    """Drop the blocks no path from the entry reaches; return the IROps dropped."""
+    reached = {function.blocks[0]}
+    stack = [function.blocks[0]]
+    while stack:
+        for successor in stack.pop().successors:
+            if successor not in reached:
+                reached.add(successor)
+                stack.append(successor)
+    if len(reached) == len(function.blocks):
+        return 0
+    removed = sum(len(block.ops) for block in function.blocks if block not in reached)
+    function.blocks = [block for block in function.blocks if block in reached]
+    function.connect()
+    return removed
+
+
+def liveness(function):
+    """Return {block: the VRegs live out of it}."""
+    uses = {}
+    defs = {}
+    for block in function.blocks:
+        used = set()
+        defined = set()
+        for op in reversed(block.ops):
+            for register in op.defs():
+                defined.add(register)
+                used.discard(register)
+            used.update(op.uses())
+        uses[block] = used
+        defs[block] = defined
+    live_in = {block: set(used) for block, used in uses.items()}
+    live_out = {block: set() for block in function.blocks}
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(function.blocks):
+            out = live_out[block]
+            for successor in block.successors:
+                out |= live_in[successor]
+            new_in = uses[block] | (out - defs[block])
+            if len(new_in) != len(live_in[block]):
+                live_in[block] = new_in
+                changed = True
+    return live_out
+
+
+def remove_dead_code(function):
+    """Drop the pure IROps whose result is never used; return how many."""
+    removed = 0
+    while True:
+        live_out = liveness(function)
+        dropped = 0
+        for block in function.blocks:
+            live = set(live_out[block])
+            kept = []
+            for op in reversed(block.ops):
+                if op.opcode in _pure_opcodes and op.dst not in live:
+                    dropped += 1
+                    continue
+                for register in op.defs():
+                    live.discard(register)
+                live.update(op.uses())
+                kept.append(op)
+            kept.reverse()
+            block.ops = kept
+        if not dropped:
+            return removed
+        removed += dropped
+
+
+# the passes run over every IRFunction before register allocation, in order
+IR_PASSES = (remove_unreachable_blocks, remove_dead_code)
+
+
+class Lowering(NodeVisitor):
+    """Lowers one FunctionDef_Node to an IRFunction.
+
+    It walks the tree in the same order as the Codegenerator, but where
+    that leaves the value of an expression in %rax, this leaves it in
+    self.value: a VReg, or an int for a constant.  Each scalar variable
+    and parameter gets one VReg; arrays stay in their frame slots.
+    self.last plays %rax between statements: a function that runs off
+    its end returns the value of the last expression statement or
+    condition it executed, as it always did.
+    """
+    def __init__(self, context=None):
+        self.context = CompileContext() if context is None else context
+        self.code = []
+        self.registers = 0
+        self.function_name = None
+        self.local_labels = 0
+        # symbol -> its VReg
+        self.variables = {}
+        # variable VReg -> number of assignments to it so far
+        self.writes = {}
+        self.value = None
+        self.last = None
+        # the (label, items) of the .rodata arrays copy_data copies
+        self.data = []
+
+    def lower(self, node):
+        self.visit(node)
+        return IRFunction.from_code(node.function_name, self.code, node.offset, self.data)
+
+    def new_register(self, symbol=None):
+        self.registers += 1
+        return VReg(self.registers, symbol)
+
+    def variable(self, symbol):
+        register = self.variables.get(symbol)
+        if register is None:
+            register = self.variables[symbol] = self.new_register(symbol)
+        return register
+
+    def emit(self, opcode, dst, *args):
+        self.code.append(IROp(opcode, dst, *args))
+
+    def hold(self):
+        """Keep self.value while more code is lowered; held() gives it back."""
+        return self.value, len(self.code), self.writes.get(self.value)
+
+    def held(self, hold):
+        # A variable operand is read where its value was wanted, not
+        # where it is used: `(x = 1) + (x = 2)` is still 3.  Only when
+        # the variable has been assigned since is that a copy.
+        value, position, writes = hold
+        if type(value) is VReg and self.writes.get(value) != writes:
+            copy = self.new_register()
+            self.code.insert(position, IROp('copy', copy, value))
+            return copy
+        return value
+
+    def assign(self, variable, value):
+        last = self.code[-1] if self.code else None
+        if type(value) is VReg and value.symbol is None and last is not None and last.dst is value:
+            # compute it straight into the variable
+            last.dst = variable
+        else:
+            self.emit('copy', variable, value)
+        self.writes[variable] = self.writes.get(variable, 0) + 1
+        self.value = variable
 
-    # 语法分析
-    parser = Parser(lexer)
-    tree = parser.parse()
+    def new_label(self):
+        self.local_labels += 1
+        return f'.{self.function_name}.sc.{self.local_labels}'
 
-    # 语义分析
-    semantic_analyzer = SemanticAnalyzer()
-    semantic_analyzer.semantic_analyze(tree)
+    def fuses(self, node):
+        return (self.context.optimize and type(node) is BinaryOp_Node
+                and node.op.type in _conditional_jumps)
 
+    def branch(self, node, label, jump_if, nested=False):
+        """Jump to `label` if the truth of condition `node` is `jump_if`.
+
+        As in Codegenerator.generate_branch(), the 0 or 1 of a comparison
+        that is a whole condition is only given to self.last on the paths
+        out (restore_condition()), so that the comparison can be fused
+        with the branch when nothing else uses it.
+        """
+        if is_logical(node, self.context):
+            if (node.op.type == TokenType.TK_AND) != jump_if:
+                yield from self.branch(node.left, label, jump_if, True)
+                yield from self.branch(node.right, label, jump_if, True)
+            else:
+                skip = self.new_label()
+                yield from self.branch(node.left, skip, not jump_if, True)
+                yield from self.branch(node.right, label, jump_if, True)
+                self.emit('label', None, skip)
+        else:
+            yield node
+            if nested or not self.fuses(node):
+                self.emit('copy', self.last, self.value)
+            self.emit('branch_nonzero' if jump_if else 'branch_zero', None, self.value, label)
+
+    def restore_condition(self, node, value):
+        if self.fuses(node):
+            self.emit('copy', self.last, value)
+
+    def statement(self, node):
+        yield node
+        if type(node) in _expression_nodes:
+            self.emit('copy', self.last, self.value)
+
+    def visit_UnaryOp_Node(self, node):
+        yield node.right
+        if node.op.type == TokenType.TK_MINUS:
+            opcode = 'neg'
+        elif node.op.type == TokenType.TK_NOT:
+            opcode = 'not'
+        else:
+            return
+        result = self.new_register()
+        self.emit(opcode, result, self.value)
+        self.value = result
+
+    def visit_Return_Node(self, node):
+        if node.right is None:
+            self.value = self.last
+        else:
+            yield node.right
+        self.emit('ret', None, self.value)
+
+    def visit_BinaryOp_Node(self, node):
+        if is_logical(node, self.context):
+            result = self.new_register()
+            false = self.new_label()
+            end = self.new_label()
+            yield from self.branch(node, false, False)
+            self.emit('copy', result, 1)
+            self.emit('jump', None, end)
+            self.emit('label', None, false)
+            self.emit('copy', result, 0)
+            self.emit('label', None, end)
+            self.value = result
+            return
+        yield node.right
+        right = self.hold()
+        yield node.left
+        left = self.value
+        right = self.held(right)
+        result = self.new_register()
+        self.emit(_binary_opcodes[node.op.type], result, left, right)
+        self.value = result
+
+    def visit_Assign_Node(self, node):
+        left = node.left
+        if left.token.type != TokenType.TK_IDENT:
+            raise SemanticError("not an lvalue", token=node.token)
+        if left.array is None:
+            yield node.right
+            self.assign(self.variable(left.symbol), self.value)
+        else:
+            yield left.index
+            index = self.hold()
+            yield node.right
+            value = self.value
+            self.emit('store', None, left.symbol.offset, self.held(index), value)
+            self.value = value
+
+    def visit_Num_Node(self, node):
+        if node.value == 'true':
+            self.value = 1
+        elif node.value == 'false':
+            self.value = 0
+        else:
+            self.value = node.value
+
+    def visit_If_Node(self, node):
+        localLabel = self.context.label_count + node.label
+        yield from self.branch(node.condition, f'.L.else.{localLabel}', False)
+        self.restore_condition(node.condition, 1)
+        if node.then_statement is not None:
+            yield from self.statement(node.then_statement)
+        self.emit('jump', None, f'.L.endd.{localLabel}')
+        self.emit('label', None, f'.L.else.{localLabel}')
+        self.restore_condition(node.condition, 0)
+        if node.else_statement is not None:
+            yield from self.statement(node.else_statement)
+        self.emit('label', None, f'.L.endd.{localLabel}')
+
+    def visit_While_Node(self, node):
+        localLabel = self.context.label_count + node.label
+        if self.context.optimize:
+            # rotated, as by Codegenerator.generate_rotated_loop()
+            self.emit('jump', None, f'.L.condition.{localLabel}')
+            self.emit('label', None, f'.L.body.{localLabel}')
+            self.restore_condition(node.condition, 1)
+            if node.statement is not None:
+                yield from self.statement(node.statement)
+            self.emit('label', None, f'.L.condition.{localLabel}')
+            yield from self.branch(node.condition, f'.L.body.{localLabel}', True)
+            self.emit('label', None, f'.L.end.{localLabel}')
+            self.restore_condition(node.condition, 0)
+            return
+        self.emit('label', None, f'.L.condition.{localLabel}')
+        yield from self.branch(node.condition, f'.L.end.{localLabel}', False)
+        if node.statement is not None:
+            yield from self.statement(node.statement)
+        self.emit('jump', None, f'.L.condition.{localLabel}')
+        self.emit('label', None, f'.L.end.{localLabel}')
+
+    def visit_Block_Node(self, node):
+        for eachnode in node.statement_nodes:
+            yield from self.statement(eachnode)
+
+    def visit_Var_array_item_Node(self, node):
+        yield node.index
+        result = self.new_register()
+        self.emit('load', result, node.symbol.offset, self.value)
+        self.value = result
+
+    def visit_Var_Node(self, node):
+        self.value = self.variable(node.symbol)
+
+    def visit_VarDecl_Node(self, node):
+        if node.var_node.array is not None:
+            array_offset = node.var_node.symbol.offset
+            array_size = node.var_node.array['size']
+            items = node.var_node.array['items']
+            if self.context.optimize and array_size >= BULK_INITIALIZATION:
+                copied = initialized_items(array_size, items)
+                if copied:
+                    self.data.append((f'.{self.function_name}.data.{len(self.data) + 1}',
+                                      items[:copied]))
+                    self.emit('copy_data', None, array_offset, self.data[-1][0], copied)
+                if copied < array_size:
+                    self.emit('zero', None, array_offset + copied * 8, array_size - copied)
+            else:
+                for i in range(array_size):
+                    # the items not given are 0
+                    self.emit('store', None, array_offset, i + 1, items[i] if i < len(items) else 0)
+            if array_size:
+                # the stack code leaves the address of the last item in %rax
+                self.emit('addr', self.last, array_offset, array_size)
+
+    def visit_FormalParam_Node(self, node):
+        pass
+
+    def visit_FunctionCall_Node(self, node):
+        holds = []
+        for eachnode in node.actual_parameter_nodes:
+            yield eachnode
+            holds.append(self.hold())
+        # the last first: each copy held() inserts moves the later positions
+        arguments = [self.held(hold) for hold in reversed(holds)]
+        arguments.reverse()
+        result = self.new_register()
+        self.emit('call', result, node.function_name, *arguments)
+        self.value = result
+
+    def visit_FunctionDef_Node(self, node):
+        self.function_name = node.function_name
+        self.last = self.new_register()
+        parameters = [self.variable(each.parameter_symbol) for each in node.formal_parameters]
+        self.emit('entry', None, *parameters)
+        self.emit('copy', self.last, 0)
+        yield node.block_node
+        self.emit('ret', None, self.last)
+        self.context.label_count += node.labels
+
+
+##################################################################################################
+#
+#  REGISTER-ALLOCATOR
+#
+##################################################################################################
+
+class LinearScanAllocator:
+    """Gives every VReg of an IRFunction a register or a frame slot.
+
+    Each VReg gets one live interval, from the first to the last position
+    it is live at, and the intervals are scanned in order of their start
+    (Poletto and Sarkar's linear scan): one takes a register free of all
+    intervals still active, or, if there is none, the register of the
+    active interval that ends last, which is spilled instead (unless the
+    new interval itself ends later).  An interval live across a call, or
+    across the rep movsq or stosq of an array initialization, only takes
+    a callee-saved register.  A spilled variable lives in the frame slot
+    the SemanticAnalyzer gave it; a spilled temporary gets a new slot
+    below them.
+
+    %rax, %rdx and %r11 are never allocated: the code for division,
+    comparisons, calls and spilled operands needs them.
+    """
+    caller_saved = ('rcx', 'rsi', 'rdi', 'r8', 'r9', 'r10')
+    callee_saved = ('rbx', 'r12', 'r13', 'r14', 'r15')
+
+    def __init__(self, function):
+        self.function = function
+        # VReg -> '%reg' or 'offset(%rbp)'; VRegs that are never live have none
+        self.locations = {}
+        # the callee-saved registers used, with the frame slots they are saved in
+        self.saved = []
+        self.frame_size = function.frame_size
+        # VReg -> [first, last] position where it is live, see positions()
+        self.intervals = {}
+
+    def allocate(self):
+        intervals, crossing = self.live_intervals(liveness(self.function))
+        self.intervals = intervals
+        self.scan(intervals, crossing)
+        return self
+
+    @staticmethod
+    def positions(function):
+        """Number the IROps in code order, each block label taking a number
+        too; return the (start, stop) positions of every block, start being
+        that of its label."""
+        ranges = []
+        position = 0
+        for block in function.blocks:
+            start = position
+            position += len(block.ops) + (block.label is not None)
+            ranges.append((start, position))
+        return ranges
+
+    def live_intervals(self, live_out):
+        """Return {VReg: [start, end]} and the VRegs live across a call."""
+        intervals = {}
+        crossing = set()
+
+        def extend(register, i):
+            interval = intervals.get(register)
+            if interval is None:
+                intervals[register] = [i, i]
+            elif i < interval[0]:
+                interval[0] = i
+            elif i > interval[1]:
+                interval[1] = i
+
+        blocks = self.function.blocks
+        for block, (start, stop) in zip(reversed(blocks), reversed(self.positions(self.function))):
+            if start == stop:
+                continue
+            live = set(live_out[block])
+            for register in live:
+                extend(register, stop - 1)
+            i = stop
+            for op in reversed(block.ops):
+                i -= 1
+                if op.opcode in _clobbering_opcodes:
+                    crossing.update(register for register in live if register is not op.dst)
+                for register in op.defs():
+                    extend(register, i)
+                    live.discard(register)
+                for register in op.uses():
+                    extend(register, i)
+                    live.add(register)
+            for register in live:
+                extend(register, start)
+        return intervals, crossing
+
+    def scan(self, intervals, crossing):
+        registers = {}
+        spilled = []
+        free = set(self.caller_saved + self.callee_saved)
+        active = []
+        order = sorted(intervals, key=lambda register: (intervals[register][0], register.number))
+        for register in order:
+            start, end = intervals[register]
+            for other in active[:]:
+                if intervals[other][1] < start:
+                    active.remove(other)
+                    free.add(registers[other])
+            pool = self.callee_saved if register in crossing else self.caller_saved + self.callee_saved
+            for name in pool:
+                if name in free:
+                    free.remove(name)
+                    registers[register] = name
+                    active.append(register)
+                    break
+            else:
+                candidates = [other for other in active if registers[other] in pool]
+                victim = max(candidates, key=lambda other: intervals[other][1], default=None)
+                if victim is not None and intervals[victim][1] > end:
+                    registers[register] = registers.pop(victim)
+                    active.remove(victim)
+                    active.append(register)
+                    spilled.append(victim)
+                else:
+                    spilled.append(register)
+
+        for register, name in registers.items():
+            self.locations[register] = f'%{name}'
+        for register in sorted(spilled, key=lambda register: register.number):
+            if register.symbol is not None:
+                self.locations[register] = f'{register.symbol.offset}(%rbp)'
+            else:
+                self.frame_size += 8
+                self.locations[register] = f'{-self.frame_size}(%rbp)'
+        used = set(registers.values())
+        for name in self.callee_saved:
+            if name in used:
+                self.frame_size += 8
+                self.saved.append((f'%{name}', f'{-self.frame_size}(%rbp)'))
+
+
+def _is_imm32(operand):
+    return operand[0] != '$' or -2**31 <= int(operand[1:]) < 2**31
+
+
+class RegallocCodegenerator(Codegenerator):
+    """The code generator of --backend=regalloc.
+
+    Each function is lowered to three-address code in basic blocks
+    (Lowering), simplified by the IR_PASSES, its VRegs are allocated by a
+    LinearScanAllocator, and every IROp becomes one or a few instructions
+    on the allocated registers and frame slots.  %rax and %r11 are the
+    scratch registers for operands that ended up in memory.  Labels are
+    numbered as by the stack code generator, so --codegen-jobs and
+    --chunk-jobs work the same with either backend.
+    """
+    _arithmetic = {'add': 'add', 'sub': 'sub', 'mul': 'imul', 'and': 'and', 'or': 'or'}
+    _commutative = frozenset(('add', 'mul', 'and', 'or'))
+    _conditions = {'eq': 'sete', 'ne': 'setne', 'lt': 'setl', 'gt': 'setg',
+                   'le': 'setle', 'ge': 'setge'}
+    _jumps = {'eq': ('je', 'jne'), 'ne': ('jne', 'je'), 'lt': ('jl', 'jge'),
+              'gt': ('jg', 'jle'), 'le': ('jle', 'jg'), 'ge': ('jge', 'jl')}
+
+    def visit_FunctionDef_Node(self, node):
+        function = Lowering(self.context).lower(node)
+        verify = self.context.verify_ir
+        if verify:
+            verify_ir(function)
+        for each in IR_PASSES:
+            each(function)
+            if verify:
+                verify_ir(function, after=each.__name__)
+        if self.context.emit_ir:
+            self.emit(str(function))
+            self.emitter.flush()
+            return
+
+        start = len(self.emitter.lines) if self.context.optimize else None
+        allocator = LinearScanAllocator(function).allocate()
+        self.locations = allocator.locations
+        self.data = function.data
+        self.reduced = 0
+        self.emit(self._text)
+        self.emit(Instruction('.global', node.function_name))
+        self.emit(Label(node.function_name))
+        # Prologue
+        self.emit(self._push_rbp)
+        self.emit(self._mov_rsp_rbp)
+        stack_size = self.align_to(allocator.frame_size, 16)
+        self.emit(Instruction('sub', f'${stack_size}', '%rsp'))
+        for register, slot in allocator.saved:
+            self.emit(Instruction('mov', register, slot))
+
+        fuse = self.context.optimize
+        last = function.blocks[-1].ops[-1]
+        # positions as numbered by the allocator, for the intervals
+        position = 0
+        for block in function.blocks:
+            if block.label is not None:
+                self.emit(Label(block.label))
+                position += 1
+            code = block.ops
+            i = 0
+            while i < len(code):
+                op = code[i]
+                if op.opcode == 'ret':
+                    self.move(self.operand(op.args[0]), '%rax')
+                    if op is not last:
+                        self.emit(Instruction('jmp', f'.{node.function_name}.return'))
+                elif (fuse and op.opcode in self._jumps and i + 1 < len(code)
+                      and code[i + 1].opcode in ('branch_zero', 'branch_nonzero')
+                      and code[i + 1].args[0] is op.dst
+                      and allocator.intervals[op.dst][1] == position + 1):
+                    # -O1: a comparison only branched on is a cmp and a conditional jump
+                    when_true, when_false = self._jumps[op.opcode]
+                    branch = code[i + 1]
+                    self.compare(op)
+                    self.emit(Instruction(when_true if branch.opcode == 'branch_nonzero'
+                                          else when_false, branch.args[1]))
+                    i += 1
+                    position += 1
+                else:
+                    getattr(self, f'generate_{op.opcode}')(op)
+                i += 1
+                position += 1
+
+        self.emit(Label(f'.{node.function_name}.return'))
+        # Epilogue
+        for register, slot in allocator.saved:
+            self.emit(Instruction('mov', slot, register))
+        self.emit(self._mov_rbp_rsp)
+        self.emit(self._pop_rbp)
+        self.emit(self._ret)
+        if start is not None:
+            self.report_strength_reduction(node.function_name)
+            code = self.emitter.lines
+            code[start:] = PeepholeOptimizer(self.context).optimize(code[start:], node.function_name)
+        self.emit_data(self.data)
+        self.emitter.flush()
+
+    def operand(self, value):
+        if type(value) is VReg:
+            return self.locations.get(value)
+        return f'${value}'
+
+    def move(self, source, destination):
+        if source == destination or destination is None:
+            return
+        if destination[0] != '%':
+            if source[0] == '$' and _is_imm32(source):
+                self.emit(Instruction('movq', source, destination))
+                return
+            if source[0] != '%':
+                self.emit(Instruction('mov', source, '%rax'))
+                source = '%rax'
+        self.emit(Instruction('mov', source, destination))
+
+    def register_source(self, operand):
+        """`operand`, in %rax if it is a constant too large for an instruction."""
+        if not _is_imm32(operand):
+            self.emit(Instruction('mov', operand, '%rax'))
+            return '%rax'
+        return operand
+
+    def parallel_move(self, moves):
+        """Do all (source, destination) `moves` as if at once."""
+        pending = [(source, destination) for source, destination in moves
+                   if destination is not None and source != destination]
+        while pending:
+            for i, (source, destination) in enumerate(pending):
+                if all(other != destination for other, _ in pending):
+                    self.move(source, destination)
+                    del pending[i]
+                    break
+            else:
+                # a cycle: every destination is still to be read; park one in %r11
+                _, destination = pending[0]
+                self.move(destination, '%r11')
+                pending = [('%r11' if source == destination else source, to)
+                           for source, to in pending]
+
+    def element(self, offset, index):
+        """The memory operand of array item `index` at frame `offset`."""
+        if type(index) is int:
+            displacement = offset + (index - 1) * 8
+            if _is_imm32(f'${displacement}'):
+                return f'{displacement}(%rbp)'
+            # too far for a displacement: the index goes in a register
+            self.emit(Instruction('mov', f'${index}', '%r11'))
+            return f'{offset - 8}(%rbp,%r11,8)'
+        register = self.operand(index)
+        if register[0] != '%':
+            self.emit(Instruction('mov', register, '%r11'))
+            register = '%r11'
+        return f'{offset - 8}(%rbp,{register},8)'
+
+    def generate_entry(self, op):
+        self.parallel_move([(f'%{parameter_registers[i]}', self.operand(parameter))
+                            for i, parameter in enumerate(op.args)])
+
+    def generate_copy(self, op):
+        self.move(self.operand(op.args[0]), self.operand(op.dst))
+
+    def generate_unary(self, op, mnemonic):
+        destination = self.operand(op.dst)
+        work = destination if destination[0] == '%' else '%r11'
+        self.move(self.operand(op.args[0]), work)
+        self.emit(Instruction(mnemonic, work))
+        self.move(work, destination)
+
+    def generate_neg(self, op):
+        self.generate_unary(op, 'neg')
+
+    def generate_not(self, op):
+        self.generate_unary(op, 'not')
+
+    def generate_arithmetic(self, op):
+        destination = self.operand(op.dst)
+        left, right = (self.operand(arg) for arg in op.args)
+        if op.opcode in self._commutative and right == destination:
+            left, right = right, left
+        if destination is not None and destination[0] == '%' and destination != right:
+            work = destination
+        else:
+            work = '%r11'
+        right = self.register_source(right)
+        self.move(left, work)
+        self.emit(Instruction(self._arithmetic[op.opcode], right, work))
+        self.move(work, destination)
+
+    generate_add = generate_sub = generate_and = generate_or = generate_arithmetic
+
+    def generate_mul(self, op):
+        left, right = op.args
+        if type(left) is int:
+            left, right = right, left
+        if self.context.optimize and type(right) is int and type(left) is VReg:
+            destination = self.operand(op.dst)
+            work = destination if destination is not None and destination[0] == '%' else '%r11'
+            # %rax is never allocated
+            code = multiplication(right, work, '%rax')
+            if code is not None:
+                self.reduced += 1
+                self.move(self.operand(left), work)
+                for instruction in code:
+                    self.emit(instruction)
+                self.move(work, destination)
+                return
+        self.generate_arithmetic(op)
+
+    def generate_div(self, op):
+        left, right = (self.operand(arg) for arg in op.args)
+        code = None
+        if self.context.optimize and type(op.args[1]) is int:
+            code = division(op.args[1], '%r11')
+        if code is not None:
+            self.reduced += 1
+            self.move(left, '%rax')
+            for instruction in code:
+                self.emit(instruction)
+            self.move('%rax', self.operand(op.dst))
+            return
+        if right[0] != '%':
+            self.emit(Instruction('mov', right, '%r11'))
+            right = '%r11'
+        self.move(left, '%rax')
+        self.emit(self._cqo)
+        self.emit(Instruction('idiv', right))
+        self.move('%rax', self.operand(op.dst))
+
+    def compare(self, op):
+        left, right = (self.operand(arg) for arg in op.args)
+        if left[0] == '$' or left[0] != '%' and right[0] != '%':
+            self.emit(Instruction('mov', left, '%r11'))
+            left = '%r11'
+        self.emit(Instruction('cmp', self.register_source(right), left))
+
+    def generate_compare(self, op):
+        self.compare(op)
+        self.emit(Instruction(self._conditions[op.opcode], '%al'))
+        destination = self.operand(op.dst)
+        if destination[0] == '%':
+            self.emit(Instruction('movzb', '%al', destination))
+        else:
+            self.emit(self._movzb_al_rax)
+            self.move('%rax', destination)
+
+    generate_eq = generate_ne = generate_lt = generate_gt = generate_le = generate_ge = generate_compare
+
+    def generate_load(self, op):
+        item = self.element(*op.args)
+        destination = self.operand(op.dst)
+        if destination[0] == '%':
+            self.emit(Instruction('mov', item, destination))
+        else:
+            self.emit(Instruction('mov', item, '%rax'))
+            self.move('%rax', destination)
+
+    def generate_store(self, op):
+        offset, index, value = op.args
+        item = self.element(offset, index)
+        self.move(self.operand(value), item)
+
+    def generate_addr(self, op):
+        destination = self.operand(op.dst)
+        work = destination if destination[0] == '%' else '%rax'
+        self.emit(Instruction('lea', self.element(*op.args), work))
+        self.move(work, destination)
+
+    def generate_call(self, op):
+        name, *arguments = op.args
+        self.parallel_move([(self.operand(argument), f'%{parameter_registers[i]}')
+                            for i, argument in enumerate(arguments)])
+        self.emit(Instruction('call', name))
+        self.move('%rax', self.operand(op.dst))
+
+    def generate_copy_data(self, op):
+        self.copy_data(*op.args)
+
+    def generate_zero(self, op):
+        self.zero_fill(*op.args)
+
+    def generate_jump(self, op):
+        self.emit(Instruction('jmp', op.args[0]))
+
+    def generate_branch_zero(self, op):
+        condition, label = op.args
+        operand = self.operand(condition)
+        if operand[0] == '$':
+            if int(operand[1:]) == 0:
+                self.emit(Instruction('jmp', label))
+            return
+        self.emit(Instruction('cmpq' if operand[0] != '%' else 'cmp', '$0', operand))
+        self.emit(Instruction('je', label))
+
+    def generate_branch_nonzero(self, op):
+        condition, label = op.args
+        operand = self.operand(condition)
+        if operand[0] == '$':
+            if int(operand[1:]) != 0:
+                self.emit(Instruction('jmp', label))
+            return
+        self.emit(Instruction('cmpq' if operand[0] != '%' else 'cmp', '$0', operand))
+        self.emit(Instruction('jne', label))
+
+
+# the code generators of --backend
+BACKENDS = {
+    'stack': Codegenerator,
+    'regalloc': RegallocCodegenerator,
+}
+
+
+##################################################################################################
+#
+#  DRIVER
+#
+##################################################################################################
+
+class CompileResult:
+    def __init__(self, name, assembly):
+        self.name = name
+        self.assembly = assembly
+
+
+def parse(context, start=0, stop=None, lineno=1):
+    """Lex and parse text[start:stop] of context.source into function definitions."""
+    text = context.source.text
+    if context.token_buffer:
+        lexer = TokenBuffer(text, start, stop, lineno)
+    else:
+        lexer = LEXERS[context.lexer](text, start, stop, lineno)
+    return PARSERS[context.parser](lexer).parse()
+
+
+def split_functions(text, pieces):
+    """Cut `text` into about `pieces` runs of whole function definitions.
+
+    A function definition ends with the "}" that brings the brace depth
+    back to zero, so cuts are only made right after such a brace.
+    Returns a (start, stop, lineno) triple per run.  Unbalanced braces
+    stop the cutting; the rest then goes to the parser as one run, which
+    reports the error.
+    """
+    braces = re.compile(r'[{}]' if isinstance(text, str) else rb'[{}]')
+    newline = '\n' if isinstance(text, str) else b'\n'
+    end_of_text = len(text)
+    target = end_of_text // pieces
+    runs = []
+    start = 0
+    lineno = 1
+    depth = 0
+    for m in braces.finditer(text):
+        if m.group() in ('{', b'{'):
+            depth += 1
+            continue
+        depth -= 1
+        if depth < 0:
+            break
+        stop = m.end()
+        if depth == 0 and stop - start >= target:
+            runs.append((start, stop, lineno))
+            lineno += text[start:stop].count(newline)
+            start = stop
+    if runs and not text[start:].strip():
+        # only blanks after the last function: no run of its own
+        start, _, lineno = runs.pop()
+    runs.append((start, end_of_text, lineno))
+    return runs
+
+
+# "if" and "while" as whole words: one label number each in the generated code
+_label_keywords = re.compile(r'\b(?:if|while)\b')
+_label_keywords_bytes = re.compile(rb'\b(?:if|while)\b')
+
+
+def compile_chunks(context, emitter, jobs):
+    """compile_to() with the functions of context.source split over processes.
+
+    Every run from split_functions() is lexed in place, at its real line
+    and column, then parsed, analyzed and generated by one forked worker,
+    which sends back only its assembly (or its error): moving the
+    FunctionDef_Node lists themselves between processes costs as much as
+    parsing them.  A run numbers its labels after the "if"s and "while"s
+    of the runs before it, so the stitched output is the same as from one
+    compile_to(), and so is the error reported: the first syntax error of
+    the file, else its first semantic error (with a TokenBuffer, which
+    lexes everything before parsing, a lexer error comes first).
+    """
+    text = context.source.text
+    runs = split_functions(text, jobs * 4)
+    keywords = _label_keywords if isinstance(text, str) else _label_keywords_bytes
+    label_base = context.label_count
+    tasks = []
+    for start, stop, lineno in runs:
+        tasks.append((start, stop, lineno, label_base))
+        label_base += len(keywords.findall(text, start, stop))
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_chunk_worker, initargs=(context,)) as executor:
+        results = list(executor.map(_compile_run, *zip(*tasks)))
+    for stage in ('lex', 'parse', 'semantic'):
+        for failed, result in results:
+            if failed == stage:
+                raise result
+    for _, assembly in results:
+        emitter.emit(assembly[:-1])
+        emitter.flush()
+    context.label_count = label_base
+
+
+# the context being compiled, in a compile_chunks() worker process
+_chunk_context = None
+
+def _init_chunk_worker(context):
+    global _chunk_context
+    _chunk_context = context
+
+def _compile_run(start, stop, lineno, label_base):
+    """Compile one run; return (None, assembly) or (failed stage, Error)."""
+    options = _chunk_context
+    context = CompileContext(options.source, options.lexer, options.parser, options.token_buffer,
+                             optimize=options.optimize, opt_report=options.opt_report,
+                             backend=options.backend, short_circuit=options.short_circuit,
+                             emit_ir=options.emit_ir, verify_ir=options.verify_ir)
+    try:
+        tree = parse(context, start, stop, lineno)
+    except Error as error:
+        if context.token_buffer and isinstance(error, LexerError):
+            return 'lex', error
+        return 'parse', error
+    try:
+        SemanticAnalyzer(context).semantic_analyze(tree)
+        if context.optimize:
+            ConstantFolder(context).fold(tree)
+            # a run does not see the calls from the rest of the file
+            tree = DeadCodeEliminator(context).eliminate(tree, whole_program=False)
+            FrameLayout(context).lay_out(tree)
+        context.label_count = label_base
+        emitter = Emitter()
+        BACKENDS[context.backend](emitter, context).code_generate(tree)
+    except Error as error:
+        return 'semantic', error
+    return None, emitter.getvalue()
+
+
+def compile_to(context, emitter):
+    """Compile context.source, sending the assembly to `emitter`.
+
+    Raises LexerError, ParserError or SemanticError on bad input.
+    """
+    if context.chunk_jobs > 1 and not context.log_scope:
+        # --scope output could not be kept in order across processes
+        compile_chunks(context, emitter, context.chunk_jobs)
+        return
+    # 词法分析, 语法分析
+    tree = parse(context)
+    # 语义分析
+    SemanticAnalyzer(context).semantic_analyze(tree)
+    if context.optimize:
+        ConstantFolder(context).fold(tree)
+        tree = DeadCodeEliminator(context).eliminate(tree)
+        FrameLayout(context).lay_out(tree)
     # 代码生成
-    code_generator= Codegenerator()
-    code_generator.code_generate(tree)
+    BACKENDS[context.backend](emitter, context).code_generate(tree)
+
+
+def compile_source(text, name='<string>', **options):
+    """Compile `text` in memory and return a CompileResult.
+
+    `options` are the CompileContext keyword arguments.  Nothing is shared
+    between calls, so this can be used for many sources in one process.
+    """
+    context = CompileContext(Inputfile(name, text), **options)
+    emitter = Emitter()
+    compile_to(context, emitter)
+    return CompileResult(name, emitter.getvalue())
+
+
+# where --cache-dir keeps its entries when not given, None: no cache
+DEFAULT_CACHE_DIR = os.environ.get('CBYPYTHON_CACHE_DIR')
+
+
+# the options that change the assembly; the engines, job counts,
+# --verify-ir and the reports give the same output byte for byte, except
+# that -O1 keeps the functions main does not call when compiling in
+# chunks, which cannot see the whole program
+OUTPUT_OPTIONS = ('optimize', 'backend', 'short_circuit', 'emit_ir')
+
+
+class CompileCache:
+    """A content-addressed store of generated assembly, like ccache.
+
+    An entry is named by the SHA-256 of the compiler's own source, the
+    OUTPUT_OPTIONS and the program text, and lives in DIRECTORY/xx/<hash>.s.
+    Entries are written to a temporary file and renamed into place, so
+    concurrent compilers never see half an entry; a hit touches the
+    entry's mtime, and when the total size grows past `max_size` the
+    least recently used entries are removed.  Stores and eviction update
+    DIRECTORY/stats.json under an flock() on DIRECTORY/lock, which is
+    what makes parallel builds sharing one directory safe.  A lookup
+    takes no lock: like ccache, it counts itself in its subdirectory,
+    appending h or m to DIRECTORY/xx/lookups, and eviction folds those
+    counts into stats.json.
+    """
+    def __init__(self, directory, max_size=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        with open(__file__, 'rb') as f:
+            self.version = hashlib.sha256(f.read()).hexdigest()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, text, options):
+        digest = hashlib.sha256(self.version.encode())
+        chunked = bool(options.get('optimize') and options.get('chunk_jobs', 1) > 1)
+        digest.update(json.dumps([options.get(name) for name in OUTPUT_OPTIONS] + [chunked]).encode())
+        digest.update(text.encode() if isinstance(text, str) else text)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:] + '.s')
+
+    def get(self, key):
+        """Return the assembly stored under `key`, or None."""
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                assembly = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # never stored, or evicted by another compiler meanwhile
+            assembly = None
+        self.count(key, b'h' if assembly is not None else b'm')
+        return assembly
+
+    def count(self, key, event):
+        # one O_APPEND write of one byte: concurrent lookups never mix
+        # up each other's, so no lock is needed
+        directory = os.path.dirname(self.path(key))
+        os.makedirs(directory, exist_ok=True)
+        fd = os.open(os.path.join(directory, 'lookups'), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(fd, event)
+        finally:
+            os.close(fd)
+
+    def lookups(self, fold=False):
+        """Count the hits and misses in the lookups files; with `fold`, remove them."""
+        hits = misses = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name, 'lookups')
+            try:
+                if fold:
+                    # a lookup of another compiler still appending to
+                    # the file renamed here can be lost, not miscounted
+                    folded = f'{path}.{os.getpid()}'
+                    os.replace(path, folded)
+                    path = folded
+                with open(path, 'rb') as f:
+                    events = f.read()
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            if fold:
+                os.remove(path)
+            hits += events.count(b'h')
+            misses += events.count(b'm')
+        return hits, misses
+
+    def put(self, key, assembly):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(assembly)
+        os.replace(temporary, path)
+        with self.locked_stats() as stats:
+            stats['stores'] += 1
+            stats['size'] += len(assembly)
+            if stats['size'] > self.max_size:
+                self.evict(stats)
+
+    def evict(self, stats):
+        # drop least recently used entries down to 90% of max_size, and
+        # recount the size, which concurrent stores of one key overstate
+        entries = []
+        for directory, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.s'):
+                    path = os.path.join(directory, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in entries:
+            if size <= self.max_size * 0.9:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            size -= entry_size
+            stats['evictions'] += 1
+        stats['size'] = size
+        hits, misses = self.lookups(fold=True)
+        stats['hits'] += hits
+        stats['misses'] += misses
+
+    @contextlib.contextmanager
+    def locked_stats(self):
+        """Hold the cache lock and yield the statistics, saved on exit."""
+        with open(os.path.join(self.directory, 'lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            stats = self.stored_stats()
+            yield stats
+            path = os.path.join(self.directory, 'stats.json')
+            with open(path + '.tmp', 'w') as f:
+                json.dump(stats, f)
+            os.replace(path + '.tmp', path)
+
+    def stored_stats(self):
+        stats = dict(hits=0, misses=0, stores=0, evictions=0, size=0)
+        with contextlib.suppress(FileNotFoundError, ValueError):
+            with open(os.path.join(self.directory, 'stats.json')) as f:
+                stats.update(json.load(f))
+        return stats
+
+    def stats(self):
+        """stats.json with the lookups not folded into it yet."""
+        stats = self.stored_stats()
+        hits, misses = self.lookups()
+        stats['hits'] += hits
+        stats['misses'] += misses
+        return stats
+
+    def show_stats(self, file=sys.stderr):
+        stats = self.stats()
+        lookups = stats['hits'] + stats['misses']
+        rate = stats['hits'] / lookups * 100 if lookups else 0
+        print(f"cache directory  {self.directory}", file=file)
+        print(f"hits             {stats['hits']} ({rate:.1f}%)", file=file)
+        print(f"misses           {stats['misses']}", file=file)
+        print(f"stores           {stats['stores']}", file=file)
+        print(f"evictions        {stats['evictions']}", file=file)
+        print(f"size             {stats['size'] / 1048576:.1f} MB of {self.max_size / 1048576:.0f} MB",
+              file=file)
+
+
+def compile_cached(context, output, options, cache=None):
+    """compile_to() `output`, a text file, going through `cache` when given.
+
+    A hit copies the stored assembly without lexing, parsing or running
+    the passes; a miss compiles as usual and stores the result.
+    """
+    if cache is None or context.log_scope or context.opt_report:
+        # --scope and --opt-report print while compiling, which a hit could not replay
+        compile_to(context, Emitter(output))
+        return
+    key = cache.key(context.source.text, options)
+    assembly = cache.get(key)
+    if assembly is None:
+        emitter = Emitter()
+        compile_to(context, emitter)
+        assembly = emitter.getvalue()
+        cache.put(key, assembly)
+    output.write(assembly)
+
+
+def compile_file(inputfile, outputfile, options, cache=None):
+    """Compile one file to `outputfile`; used by the batch driver's workers.
+
+    Never raises for bad input: returns (inputfile, error message or None,
+    source size in bytes), so one broken file does not stop a batch.
+    """
+    context = None
+    try:
+        context = CompileContext(Inputfile.load(inputfile), **options)
+        with open(outputfile, 'w') as output:
+            compile_cached(context, output, options, cache)
+        return inputfile, None, len(context.source.text)
+    except Exception as error:
+        if os.path.exists(outputfile):
+            os.remove(outputfile)
+        if isinstance(error, Error) and context is not None:
+            report = io.StringIO()
+            error.show_error_at(context.source, file=report)
+            return inputfile, report.getvalue(), 0
+        return inputfile, f"{inputfile}: {type(error).__name__}: {error}\n", 0
+
+
+def collect_inputs(paths):
+    """Expand directories into the .c files below them, in sorted order."""
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirectories, files in os.walk(path):
+                subdirectories.sort()
+                inputs.extend(os.path.join(directory, f) for f in sorted(files) if f.endswith('.c'))
+        else:
+            inputs.append(path)
+    return inputs
+
+
+def assembly_name(inputfile, output_directory):
+    name = os.path.splitext(inputfile)[0] + '.s'
+    if output_directory is not None:
+        name = os.path.join(output_directory, os.path.basename(name))
+    return name
+
+
+def compile_batch(inputs, jobs, output_directory, options, cache=None):
+    """Compile `inputs` on `jobs` worker processes, one .s file per input.
+
+    Failures are reported on stderr without stopping the other files.
+    Returns the number of files that failed.
+    """
+    start = time.perf_counter()
+    outputs = [assembly_name(inputfile, output_directory) for inputfile in inputs]
+    failed = 0
+    total_bytes = 0
+    # hand out the files in chunks, so that small files do not pay a round trip each
+    chunksize = max(1, len(inputs) // (jobs * 4))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        for inputfile, message, size in executor.map(compile_file, inputs, outputs,
+                                                      [options] * len(inputs),
+                                                      [cache] * len(inputs),
+                                                      chunksize=chunksize):
+            if message is not None:
+                failed += 1
+                print(message, end='', file=sys.stderr)
+            total_bytes += size
+    seconds = time.perf_counter() - start
+    print(f"{len(inputs)} files, {failed} failed, {jobs} jobs, {seconds:.2f} s: "
+          f"{len(inputs) / seconds:.1f} files/s, {total_bytes / seconds / 1e6:.2f} MB/s",
+          file=sys.stderr)
+    return failed
+
+
+# where --server listens and cbyclient.py connects by default
+DEFAULT_SOCKET = os.environ.get('CBYPYTHON_SOCKET') or f'/tmp/cbypython-{os.getuid()}.sock'
+
+
+# the CompileContext options a client may send; log_scope and
+# opt_report would print to the server's own stdout and stderr, and
+# chunk_jobs and codegen_jobs would fork worker processes from a handler
+# thread
+SERVER_OPTIONS = frozenset(('optimize', 'backend', 'short_circuit', 'emit_ir', 'verify_ir',
+                            'lexer', 'parser', 'token_buffer'))
+
+def compile_request(request):
+    """Compile one client request, see cbyclient.py for the protocol."""
+    name = request.get('name', '<string>')
+    options = request.get('options', {})
+    refused = sorted(set(options) - SERVER_OPTIONS)
+    if refused:
+        return {'status': 1, 'assembly': '',
+                'diagnostics': f"{name}: the server does not take {', '.join(refused)}\n"}
+    try:
+        context = CompileContext(Inputfile(name, request['source']), **options)
+        emitter = Emitter()
+        compile_to(context, emitter)
+    except Error as error:
+        report = io.StringIO()
+        error.show_error_at(context.source, file=report)
+        return {'status': 1, 'assembly': '', 'diagnostics': report.getvalue()}
+    except Exception as error:
+        return {'status': 1, 'assembly': '',
+                'diagnostics': f"{name}: {type(error).__name__}: {error}\n"}
+    return {'status': 0, 'assembly': emitter.getvalue(), 'diagnostics': ''}
+
+
+class CompileRequestHandler(socketserver.StreamRequestHandler):
+    # every message, both ways, is a 4-byte big-endian length and that much JSON
+    def handle(self):
+        header = self.rfile.read(4)
+        if len(header) < 4:
+            return
+        (length,) = struct.unpack('>I', header)
+        reply = compile_request(json.loads(self.rfile.read(length)))
+        data = json.dumps(reply).encode()
+        self.wfile.write(struct.pack('>I', len(data)) + data)
+
+
+class CompileServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(path):
+    """Keep a warm compiler listening on the Unix socket `path`."""
+    if os.path.exists(path):
+        # left behind by a server that did not shut down cleanly
+        os.remove(path)
+    # let `kill` clean up the socket the same way Ctrl-C does
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with CompileServer(path, CompileRequestHandler) as server:
+        print(f"cbypython: serving on {path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='cbypython - Simple C-like Compiler'
+    )
+    parser.add_argument('inputfiles', nargs='*', metavar='inputfile',
+                        help='C-like source file ("-" for stdin); several files or a '
+                             'directory are compiled as a batch, one .s per file')
+    parser.add_argument('-o', dest='output', default=None,
+                        help='write the assembly to OUTPUT instead of stdout '
+                             '(for a batch: the directory for the .s files)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='compile a batch on JOBS processes (default: one per CPU)')
+    parser.add_argument('--lexer', choices=sorted(LEXERS), default='table',
+                        help='lexer engine (default: %(default)s)')
+    parser.add_argument('--parser', choices=sorted(PARSERS), default='climbing',
+                        help='expression parser (default: %(default)s)')
+    parser.add_argument('--token-buffer', action='store_true',
+                        help='lex the whole input into a compact TokenBuffer before parsing')
+    parser.add_argument('--chunk-jobs', type=int, default=1, metavar='JOBS',
+                        help='compile a file in runs of whole functions on JOBS processes '
+                             '(default: %(default)s)')
+    parser.add_argument('--codegen-jobs', type=int, default=1, metavar='JOBS',
+                        help='generate the functions of a file on JOBS processes '
+                             '(default: %(default)s)')
+    parser.add_argument('-O', dest='optimize', type=int, choices=(0, 1), default=0,
+                        help='-O1 folds constants, removes dead code, shares frame slots '
+                             'between blocks, multiplies and divides by constants without '
+                             'imul and idiv and runs the peephole optimizer over the '
+                             'generated code '
+                             '(default: -O%(default)s)')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='stack',
+                        help='code generator: the stack machine, or linear-scan register '
+                             'allocation over three-address code (default: %(default)s)')
+    parser.add_argument('--short-circuit', action='store_true',
+                        help='evaluate && and || as C does: left to right, the right operand '
+                             'only if needed, giving 0 or 1 (default: both operands, combined '
+                             'bitwise)')
+    parser.add_argument('--emit-ir', action='store_true',
+                        help='print the three-address code of each function, in basic '
+                             'blocks, instead of the assembly (implies --backend=regalloc)')
+    parser.add_argument('--verify-ir', action='store_true',
+                        help='check the three-address code after lowering and after every '
+                             'IR pass, failing on a broken invariant')
+    parser.add_argument('--opt-report', action='store_true',
+                        help='report on stderr what the optimizer removed from each function')
+    parser.add_argument('--scope', action='store_true',
+                        help='log entering and leaving scopes during semantic analysis')
+    parser.add_argument('--server', nargs='?', const=DEFAULT_SOCKET, metavar='SOCKET',
+                        help='keep a warm compiler listening on a Unix socket for cbyclient.py '
+                             '(default: %(const)s)')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='reuse assembly compiled before from this directory '
+                             '(default: $CBYPYTHON_CACHE_DIR, or no cache)')
+    parser.add_argument('--cache-size', type=int, default=1024, metavar='MB',
+                        help='evict least recently used entries beyond this size '
+                             '(default: %(default)s)')
+    parser.add_argument('--cache-stats', action='store_true',
+                        help='print the cache statistics and exit')
+    args = parser.parse_args()
+
+    cache = None
+    if args.cache_dir:
+        cache = CompileCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    if args.cache_stats:
+        if cache is None:
+            parser.error('--cache-stats needs --cache-dir or $CBYPYTHON_CACHE_DIR')
+        cache.show_stats()
+        return
+    if args.server is not None:
+        serve(args.server)
+        return
+    if not args.inputfiles:
+        parser.error('the following arguments are required: inputfile')
+    options = dict(lexer=args.lexer, parser=args.parser,
+                   token_buffer=args.token_buffer, log_scope=args.scope,
+                   chunk_jobs=args.chunk_jobs, codegen_jobs=args.codegen_jobs,
+                   optimize=args.optimize, opt_report=args.opt_report,
+                   backend='regalloc' if args.emit_ir else args.backend,
+                   short_circuit=args.short_circuit,
+                   emit_ir=args.emit_ir, verify_ir=args.verify_ir)
+
+    if len(args.inputfiles) > 1 or args.jobs is not None or os.path.isdir(args.inputfiles[0]):
+        if '-' in args.inputfiles:
+            parser.error('"-" cannot be part of a batch')
+        if args.output is not None:
+            os.makedirs(args.output, exist_ok=True)
+        inputs = collect_inputs(args.inputfiles)
+        jobs = args.jobs or os.cpu_count() or 1
+        sys.exit(1 if compile_batch(inputs, jobs, args.output, options, cache) else 0)
+
+    # 读入源程序
+    context = CompileContext(Inputfile.load(args.inputfiles[0]), **options)
+    try:
+        if args.output is None or args.output == '-':
+            compile_cached(context, sys.stdout, options, cache)
+        else:
+            with open(args.output, 'w') as output:
+                compile_cached(context, output, options, cache)
+    except Error as error:
+        if args.output not in (None, '-') and os.path.exists(args.output):
+            os.remove(args.output)
+        error.show_error_at(context.source)
+        sys.exit(1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -4,7 +4,7 @@ assert() {
   expected="$1"
   input="$2"
 
-  echo "$input" | python3 cbypython.py - > tmp.s || exit
+  echo "$input" | python3 cbypython.py $CBYPYTHON_FLAGS - > tmp.s || exit
   #  python3 cbypython.py "$input" > tmp.s
   gcc  -o tmp tmp.s
   ./tmp
@@ -88,4 +88,48 @@ i = i+1;
 }
 return array[min];
 }'
+assert 2 'int main() {if (1>2) then return 1; else return 2;}'
+assert 0 'int main() {int a; a = 3; if (a - 3) then a = 7; else {int b;}}'
+assert 1 'int main() {int i; i = 0; while (0) i = i + 1; return 0 - -1;}'
+assert 10 'int main() {int a, b; a = 2; b = 3; if (a < b) then a = a * 5; return a;}'
+assert 5 'int main() {int a, i; a = 1; i = 0; while (i < 4) { a = a + 1; i = i + 1; } return a;}'
+assert 254 'int main() {int a; a = 0; return !a - 1;}'
+assert 1 'int main() {int a; a = 1; if (a < 2) then {int b;}}'
+assert 0 'int main() {int a; a = 5; if (a > 9) then a = 1; else {int c;}}'
+assert 0 'int main() {int i; i = 0; while (i < 3) i = i + 1;}'
+assert 6 'int main() {int i, s; i = 0; s = 0; while (i <= 3) {s = s + i; i = i + 1;} return s;}'
+assert 3 'int main() {1; 2; 3; int x;}'
+assert 6 'int main() {int a; a = 6; if (a) then {1; a;}}'
+assert 4 'int main() {int a; a = 0; while (a < 4) {a = a + 1; 7;} return a; a = 9; 9;}'
+assert 2 'int f() {return 1;} int g() {return f() + 1;} int h() {return 5;} int main() {return g();}'
+assert 20 'int main() {int x[20]={1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20}; return x[20] + x[1] - 1;}'
+assert 6 'int main() {int x[30]={5,6,0,0}; int y[16]={0}; return x[2] + x[30] + y[16];}'
+assert 7 'int main() {int y[3]={7}; return y[1] + y[3];}'
+assert 5 'int main() {int s; s = 0; {int a; a = 2; s = s + a;} {int b; b = 3; s = s + b;} return s;}'
+assert 8 'int main() {int s; {int x[2]={1,2}; s = x[2];} {int y[3]={4,5,6}; s = s + y[3]; {int z; z = s;} } return s;}'
+assert 11 'int f(int n) {if (n == 0) then return 1; {int a; a = n;} {int b; b = f(n - 1); return b + 2;}} int main() {return f(5);}'
+assert 3 'int f(int a) {int b, c, d, e, g, h, k; b = a + 1; c = a + 2; d = a + 3; e = a + 4; g = a + 5; h = a + 6; k = a + 7; if (a) then return b + c + d + e + g + h + k; return b * c * d * e * g * h * k;} int main() {int x, y; x = f(0) + 3; y = f(1); return x - 5040 + y - 35;}'
+assert 15 'int g(int i) {int a[3]={4,5,6}; a[i] = a[i] + a[3]; return a[i] + a[1];} int main() {return g(2);}'
+assert 3 'int main() {int a[3]={0,0,0}; int i; a[(i = 2)] = i + 1; return a[2];}'
+assert 9 'int main() {int a[4]={4,3,2,1}; int b[2]={0,0}; b[a[3]] = a[a[4]] + 5; return b[2];}'
+assert 8 'int main() {int a[2]={5000000000,3}; return a[1] / 1000000000 + a[2];}'
+assert 2 'int f(int c) {int x[3]={1,2,3}; if (c) then x[300000000]=1; if (c) then return x[300000000]; return x[2];} int main() {return f(0);}'
+
+assert 0 'int q(int n, int d) {return (n / 3 != n / d) + (n / -7 != n / (d - 10)) + (n / 10 != n / (d + 7)) + (n / 641 != n / (d + 638)) + (n / 4611686018427387905 != n / (d + 4611686018427387902)) + (n / 2 != n / (d - 1)) + (n / 8 != n / (d + 5)) + (n / -4 != n / (d - 7)) + (n / 1 != n / (d - 2)) + (n / -9223372036854775807 != n / (d - 9223372036854775807 - 3)) + (n / (-9223372036854775807 - 1) != n / (d - 9223372036854775807 - 4));} int main() {int i, n, bad; bad = q(0 - 9223372036854775807 - 1, 3) + q(9223372036854775807, 3) + q(0 - 9223372036854775807, 3) + q(-1, 3) + q(0, 3) + q(1, 3) + q(20, 3) + q(-20, 3) + q(-21, 3); n = 1; i = 0; while (i < 3000) {n = n * 6364136223846793005 + 1442695040888963407; bad = bad + q(n, 3) + q(n / 1048576, 3); i = i + 1;} return bad;}'
+assert 0 'int p(int n, int m) {return (n * 2 != n * m) + (n * 3 != n * (m + 1)) + (10 * n != (m + 8) * n) + (n * 24 != n * (m + 22)) + (n * -3 != n * (m - 5)) + (n * 17 != n * (m + 15)) + (n * 31 != n * (m + 29)) + (n * 45 != n * (m + 43)) + (n * 0 != n * (m - 2)) + (n * 1 != n * (m - 1)) + (n * -1 != n * (m - 3)) + (n * 100 != n * (m + 98)) + (n * 9223372036854775807 != n * (m + 9223372036854775805)) + (n * (-9223372036854775807 - 1) != n * (m - 9223372036854775807 - 3));} int main() {int i, n, bad; bad = p(0 - 9223372036854775807 - 1, 2) + p(9223372036854775807, 2) + p(-1, 2) + p(0, 2) + p(1, 2); n = 1; i = 0; while (i < 3000) {n = n * 6364136223846793005 + 1442695040888963407; bad = bad + p(n, 2); i = i + 1;} return bad;}'
+assert 107 'int main() {int a[4]={10,20,30,40}; int i, s; s = 0; i = 1; while (i < 5) {s = s + a[i] * 3 / 2; i = i + 1;} return s / -7 * -5 + 2;}'
+
+# --short-circuit: && and || skip the right operand when the left one decides
+assert_short_circuit() {
+  CBYPYTHON_FLAGS="$CBYPYTHON_FLAGS --short-circuit" assert "$@"
+}
+
+assert_short_circuit 1 'int crash(int x) {return x / 0;} int main() {if (0 && crash(1)) then return 2; return 1;}'
+assert_short_circuit 3 'int crash(int x) {return x / 0;} int main() {if ((1 < 2) || crash(1)) then return 3; return 4;}'
+assert_short_circuit 0 'int crash(int x) {return x / 0;} int main() {int b; b = (1 > 2) && crash(0); return b;}'
+assert_short_circuit 1 'int main() {int a; a = 1; if (0 && (a = 5)) then a = 9; return a;}'
+assert_short_circuit 5 'int main() {int a; a = 1; if (a && (a = 5)) then return a; return 0;}'
+assert_short_circuit 1 'int main() {return 2 && 1;}'
+assert_short_circuit 7 'int main() {int i, n; i = 0; n = 0; while (i < 10 && n < 7) {n = n + 1; i = i + 1;} return n;}'
+assert_short_circuit 2 'int main() {int a, b; a = 0; b = 3; if (a || b - 3 || (a = 2)) then return a; return 9;}'
 echo OK